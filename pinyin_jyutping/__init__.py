@@ -1,56 +1,332 @@
 import os
+import copy
+import time
 import pickle
 import jieba
 import logging
 from . import constants
 from . import conversion
 from . import parser
+from . import compact
+from . import data
+from . import syllables
+from . import tokenizer
+from . import parallel
+from . import cache
+from . import instrumentation
+from . import asynchronous
 
 logger = logging.getLogger(__file__)
 
 class PinyinJyutping():
-    def __init__(self):
-        self.load_data()
-        self.initialize_jieba()
+    def __init__(self, compact_data=False, lazy=False, segmenter=constants.Segmenter.jieba, cache_size=0, stats=None, tone_sandhi=constants.TONE_SANDHI_DEFAULT):
+        # compact_data: use the memory-mapped data file instead of the pickle. the pages are shared
+        # between all the processes which load it, and startup is much faster.
+        # lazy: don't load anything until it's needed. the pinyin and jyutping maps, and the jieba
+        # model are loaded independently, on first use.
+        # segmenter: constants.Segmenter.jieba, or constants.Segmenter.dag to use the built-in segmenter
+        # driven by the dictionary, instead of jieba.
+        # cache_size: keep the results of the last cache_size pinyin() / jyutping() calls, for repetitive
+        # input. disabled by default, see cache_stats()
+        # stats: an instrumentation.ConversionStats, which accumulates the time spent in each stage of the
+        # conversion, and counters. can also be set later through the stats attribute. not collected from
+        # the worker processes of pinyin_parallel / jyutping_parallel, nor for results served from the cache.
+        # tone_sandhi: pinyin tone changes to apply, constants.ToneSandhi flags, for example
+        # ToneSandhi.bu_yi | ToneSandhi.third_tone. only 不 / 一 before a fourth tone by default.
+        self.compact_data = compact_data
+        self.lazy = lazy
+        self.segmenter = segmenter
+        # dictionary segmenters, built on first use for each map
+        self.dag_tokenizers = {}
+        # time spent in each initialization phase, in seconds
+        self.timings = {}
+        self.stats = stats
+        self.tone_sandhi = tone_sandhi
+        self.result_cache = None
+        if cache_size > 0:
+            self.result_cache = cache.LRUCache(cache_size)
+        # corrections applied to this instance, (map name, corrections), see replayed_corrections
+        self.corrections = []
+        # incremented whenever corrections get loaded, see data_generation
+        self.generation = 0
+        # runs apinyin / ajyutping, created on first use, see configure_async
+        self.async_converter = None
+        # the instance this one is an overlay of, see create_overlay
+        self.base_instance = None
+        # data_generation() of the base instance when the overlay's segmenters and cached results were built
+        self.base_generation = 0
+        self.jieba_dictionary_set = False
+        self.jieba_ready = False
+        if self.lazy:
+            self.data = data.LazyData(self.load_pinyin_map, self.load_jyutping_map)
+        else:
+            self.load_data()
+            self.initialize_jieba()
+
+    def record_timing(self, phase, start_time):
+        self.timings[phase] = time.perf_counter() - start_time
 
     def load_data(self):
+        start_time = time.perf_counter()
+        module_dir = os.path.dirname(__file__)
+        if self.compact_data:
+            self.data = compact.load_compact_data(os.path.join(module_dir, constants.COMPACT_DATA_FILENAME))
+        else:
+            # the same per-map pickles as lazy loading, the data is only shipped once
+            self.data = data.Data()
+            self.data.pinyin_map = self.load_pinyin_map()
+            self.data.jyutping_map = self.load_jyutping_map()
+        self.record_timing('load_data', start_time)
+
+    def load_map(self, map_name, pickle_filename):
+        start_time = time.perf_counter()
         module_dir = os.path.dirname(__file__)
-        pickle_filepath = os.path.join(module_dir, constants.PICKLE_DATA_FILENAME)
-        f = open(pickle_filepath, 'rb')
-        self.data = pickle.load(f)
-        f.close()
+        if self.compact_data:
+            word_map = compact.load_compact_word_map(os.path.join(module_dir, constants.COMPACT_DATA_FILENAME), map_name)
+        else:
+            f = open(os.path.join(module_dir, pickle_filename), 'rb')
+            word_map = pickle.load(f)
+            f.close()
+            # data files built by older versions
+            syllables.intern_syllables(word_map)
+        self.record_timing(f'load_{map_name}', start_time)
+        return word_map
+
+    def load_pinyin_map(self):
+        return self.load_map('pinyin_map', constants.PINYIN_MAP_PICKLE_DATA_FILENAME)
+
+    def load_jyutping_map(self):
+        return self.load_map('jyutping_map', constants.JYUTPING_MAP_PICKLE_DATA_FILENAME)
 
     def initialize_jieba(self):
+        start_time = time.perf_counter()
         module_dir = os.path.dirname(__file__)
-        jieba_big_dictionary_filename = os.path.join(module_dir, "dict.txt.big")
-        jieba.set_dictionary(jieba_big_dictionary_filename)        
+        jieba_big_dictionary_filename = os.path.join(module_dir, constants.JIEBA_DICTIONARY_FILENAME)
+        jieba.set_dictionary(jieba_big_dictionary_filename)
+        self.jieba_dictionary_set = True
+        self.record_timing('set_jieba_dictionary', start_time)
+
+    def warmup_jieba(self):
+        # jieba builds its prefix dictionary on the first cut, do it here so that we can time it
+        if self.jieba_ready:
+            return
+        if self.base_instance != None:
+            # jieba is global, the instance which owns it keeps track of its state
+            self.base_instance.warmup_jieba()
+            self.jieba_ready = True
+            return
+        if not self.jieba_dictionary_set:
+            self.initialize_jieba()
+        start_time = time.perf_counter()
+        module_dir = os.path.dirname(__file__)
+        dictionary_filepath = os.path.join(module_dir, constants.JIEBA_DICTIONARY_FILENAME)
+        cache_filepath = os.path.join(module_dir, constants.JIEBA_CACHE_FILENAME)
+        if not tokenizer.load_jieba_cache(dictionary_filepath, cache_filepath):
+            jieba.initialize()
+        self.record_timing('initialize_jieba', start_time)
+        self.jieba_ready = True
+
+    def get_tokenizer(self, map_name):
+        # returns None when using jieba, conversion takes care of it
+        if self.segmenter != constants.Segmenter.dag:
+            self.warmup_jieba()
+            return None
+        self.check_base_generation()
+        dag_tokenizer = self.dag_tokenizers.get(map_name, None)
+        if dag_tokenizer == None:
+            start_time = time.perf_counter()
+            word_map = getattr(self.data, map_name)
+            if self.base_instance == None:
+                dag_tokenizer = tokenizer.DagTokenizer(word_map)
+            elif len(word_map.entries) == 0:
+                dag_tokenizer = self.base_instance.get_tokenizer(map_name)
+            else:
+                # only the corrections of the overlay get weighed, on top of the base instance's segmenter
+                dag_tokenizer = tokenizer.DagTokenizer(word_map, self.base_instance.get_tokenizer(map_name))
+            self.record_timing(f'build_{map_name}_segmenter', start_time)
+            self.dag_tokenizers[map_name] = dag_tokenizer
+        return dag_tokenizer
+
+    def import_corrections(self, map_name, source, file_format):
+        # corrections still go through jieba, like the rest of the dictionary
+        self.warmup_jieba()
+        # words and weights may have changed
+        self.dag_tokenizers.pop(map_name, None)
+        parse_function = parser.parse_pinyin if map_name == 'pinyin_map' else parser.parse_jyutping
+        entries = parser.read_correction_entries(source, file_format)
+        additions, accepted, rejected = parser.correction_entries_word_additions(map_name, entries, parse_function)
+        parser.apply_word_additions(additions, self.data, priority=True)
+        self.corrections.append((map_name, accepted))
+        self.generation += 1
+        # cached results may be out of date
+        self.clear_result_cache()
+        return {
+            'accepted': len(accepted),
+            'rejected': rejected
+        }
+
+    def import_pinyin_corrections(self, source, file_format=None):
+        # source: path of a json or csv file, open file object, or iterable of {'chinese', 'pinyin'} dicts.
+        # file_format: constants.CorrectionFormat, taken from the file extension by default. all the entries
+        # are parsed before any gets applied. returns {'accepted': count, 'rejected': [{'index', 'entry', 'error'}]}
+        return self.import_corrections('pinyin_map', source, file_format)
+
+    def import_jyutping_corrections(self, source, file_format=None):
+        # same, with {'chinese', 'jyutping'} entries
+        return self.import_corrections('jyutping_map', source, file_format)
 
     def load_pinyin_corrections(self, corrections):
-        for correction in corrections:
-            try:
-                chinese = correction['chinese']
-                pinyin = correction['pinyin']
-                parser.parse_pinyin_correction(chinese, pinyin, self.data)
-            except Exception as e:
-                logger.exception(e)
+        self.log_rejected_corrections(self.import_corrections('pinyin_map', corrections, None))
 
     def load_jyutping_corrections(self, corrections):
-        for correction in corrections:
-            try:
-                chinese = correction['chinese']
-                jyutping = correction['jyutping']
-                parser.parse_jyutping_correction(chinese, jyutping, self.data)
-            except Exception as e:
-                logger.exception(e)                
+        self.log_rejected_corrections(self.import_corrections('jyutping_map', corrections, None))
+
+    def log_rejected_corrections(self, report):
+        for rejected in report['rejected']:
+            logger.warning(f'could not load correction {rejected["entry"]}: {rejected["error"]}')
+
+    def create_overlay(self):
+        # returns a PinyinJyutping which shares the dictionary, jieba and settings of this instance, and
+        # takes corrections of its own, for a user or a single request: they go to an overlay over the
+        # dictionary, which stays untouched. creating one doesn't copy anything, discarding it is dropping
+        # the reference, and overlays can themselves be overlaid. corrections loaded into this instance
+        # afterwards show through, except for the words the overlay corrected.
+        overlay = copy.copy(self)
+        overlay.base_instance = self
+        overlay.base_generation = self.data_generation()
+        overlay.data = data.OverlayData(self.data)
+        overlay.dag_tokenizers = {}
+        overlay.corrections = []
+        overlay.generation = 0
+        # apinyin / ajyutping go through the base instance's converter
+        overlay.async_converter = None
+        if self.result_cache != None:
+            overlay.result_cache = cache.LRUCache(self.result_cache.max_size)
+        return overlay
+
+    def data_generation(self):
+        # changes whenever corrections get loaded into this instance, or into the ones it's an overlay of
+        if self.base_instance == None:
+            return self.generation
+        return self.generation + self.base_instance.data_generation()
+
+    def check_base_generation(self):
+        # corrections loaded into the base instance since the overlay's segmenters and cached results were
+        # built change the words the overlay sees, they're out of date
+        if self.base_instance == None:
+            return
+        base_generation = self.base_instance.data_generation()
+        if base_generation != self.base_generation:
+            self.base_generation = base_generation
+            self.dag_tokenizers = {}
+            self.clear_result_cache()
+
+    def replayed_corrections(self):
+        # all the corrections applied to the data of this instance and the ones it's an overlay of, in order,
+        # for spawned worker processes, which load the dictionary from scratch
+        if self.base_instance == None:
+            return list(self.corrections)
+        return self.base_instance.replayed_corrections() + self.corrections
+
+    def clear_result_cache(self):
+        if self.result_cache != None:
+            self.result_cache.clear()
+
+    def cache_stats(self):
+        # hits, misses, evictions, size and max_size of the result cache, None if it's disabled
+        if self.result_cache == None:
+            return None
+        return self.result_cache.stats()
 
     def pinyin(self, text, tone_numbers=False, spaces=False):
-        return conversion.convert_pinyin_single_solution(self.data, text, tone_numbers, spaces)
+        if self.result_cache == None:
+            return conversion.convert_pinyin_single_solution(self.data, text, tone_numbers, spaces, self.get_tokenizer('pinyin_map'), self.stats, self.tone_sandhi)
+        self.check_base_generation()
+        key = (text, 'pinyin', tone_numbers, spaces)
+        result = self.result_cache.get(key)
+        if result == None:
+            result = conversion.convert_pinyin_single_solution(self.data, text, tone_numbers, spaces, self.get_tokenizer('pinyin_map'), self.stats, self.tone_sandhi)
+            self.result_cache.put(key, result)
+        return result
 
     def jyutping(self, text, tone_numbers=False, spaces=False):
-        return conversion.convert_jyutping_single_solution(self.data, text, tone_numbers, spaces)
+        if self.result_cache == None:
+            return conversion.convert_jyutping_single_solution(self.data, text, tone_numbers, spaces, self.get_tokenizer('jyutping_map'), self.stats)
+        self.check_base_generation()
+        key = (text, 'jyutping', tone_numbers, spaces)
+        result = self.result_cache.get(key)
+        if result == None:
+            result = conversion.convert_jyutping_single_solution(self.data, text, tone_numbers, spaces, self.get_tokenizer('jyutping_map'), self.stats)
+            self.result_cache.put(key, result)
+        return result
     
+    def pinyin_batch(self, texts, tone_numbers=False, spaces=False):
+        return conversion.convert_pinyin_single_solution_batch(self.data, texts, tone_numbers, spaces, self.get_tokenizer('pinyin_map'), self.stats, self.tone_sandhi)
+
+    def jyutping_batch(self, texts, tone_numbers=False, spaces=False):
+        return conversion.convert_jyutping_single_solution_batch(self.data, texts, tone_numbers, spaces, self.get_tokenizer('jyutping_map'), self.stats)
+
+    def pinyin_stream(self, lines, tone_numbers=False, spaces=False, chunk_size=constants.STREAM_CHUNK_SIZE):
+        # lines: any iterable of lines, like an open file. yields the converted lines as they come
+        return conversion.convert_pinyin_single_solution_stream(self.data, lines, tone_numbers, spaces, self.get_tokenizer('pinyin_map'), chunk_size, self.stats, self.tone_sandhi)
+
+    def jyutping_stream(self, lines, tone_numbers=False, spaces=False, chunk_size=constants.STREAM_CHUNK_SIZE):
+        return conversion.convert_jyutping_single_solution_stream(self.data, lines, tone_numbers, spaces, self.get_tokenizer('jyutping_map'), chunk_size, self.stats)
+
+    def pinyin_parallel(self, texts, tone_numbers=False, spaces=False, processes=None, chunk_size=constants.PARALLEL_CHUNK_SIZE):
+        # same as pinyin_batch, spread over a pool of processes (one per core by default)
+        return parallel.convert_parallel(self, 'pinyin_map', texts, tone_numbers, spaces, processes, chunk_size)
+
+    def jyutping_parallel(self, texts, tone_numbers=False, spaces=False, processes=None, chunk_size=constants.PARALLEL_CHUNK_SIZE):
+        return parallel.convert_parallel(self, 'jyutping_map', texts, tone_numbers, spaces, processes, chunk_size)
+
+    def configure_async(self, executor=constants.Executor.thread, max_workers=None, max_pending=constants.ASYNC_MAX_PENDING):
+        # executor: constants.Executor.thread (default) or constants.Executor.process, see asynchronous.py
+        # max_pending: number of conversions submitted to the executor at once, further callers wait.
+        # overlays share the converter of their base instance, configuring it from one configures the base's
+        if self.base_instance != None:
+            self.base_instance.configure_async(executor, max_workers, max_pending)
+            return
+        self.shutdown_async(wait=False)
+        self.async_converter = asynchronous.AsyncConverter(self, executor, max_workers, max_pending)
+
+    def shutdown_async(self, wait=True):
+        if self.base_instance != None:
+            self.base_instance.shutdown_async(wait)
+            return
+        if self.async_converter != None:
+            self.async_converter.shutdown(wait)
+
+    def get_async_converter(self):
+        if self.base_instance != None:
+            return self.base_instance.get_async_converter()
+        if self.async_converter == None:
+            self.configure_async()
+        return self.async_converter
+
+    async def apinyin(self, text, tone_numbers=False, spaces=False):
+        # same as pinyin, without blocking the event loop
+        return await self.get_async_converter().convert(self, 'pinyin_map', text, tone_numbers, spaces)
+
+    async def ajyutping(self, text, tone_numbers=False, spaces=False):
+        return await self.get_async_converter().convert(self, 'jyutping_map', text, tone_numbers, spaces)
+
     def pinyin_all_solutions(self, text, tone_numbers=False, spaces=False):
-        return conversion.convert_pinyin_all_solutions(self.data, text, tone_numbers, spaces)
+        return conversion.convert_pinyin_all_solutions(self.data, text, tone_numbers, spaces, self.get_tokenizer('pinyin_map'), self.stats, self.tone_sandhi)
 
     def jyutping_all_solutions(self, text, tone_numbers=False, spaces=False):
-        return conversion.convert_jyutping_all_solutions(self.data, text, tone_numbers, spaces)        
+        return conversion.convert_jyutping_all_solutions(self.data, text, tone_numbers, spaces, self.get_tokenizer('jyutping_map'), self.stats)        
+
+    def pinyin_solutions_generator(self, text, tone_numbers=False, spaces=False, limit=None):
+        # all the solutions for the whole text, lazily, most probable first
+        return conversion.pinyin_solutions_generator(self.data, text, tone_numbers, spaces, limit, self.get_tokenizer('pinyin_map'), self.stats, self.tone_sandhi)
+
+    def jyutping_solutions_generator(self, text, tone_numbers=False, spaces=False, limit=None):
+        return conversion.jyutping_solutions_generator(self.data, text, tone_numbers, spaces, limit, self.get_tokenizer('jyutping_map'), self.stats)
+
+    def parse_pinyin_batch(self, texts):
+        # validates romanized input, see parser.parse_romanization_batch. doesn't need the dictionary
+        return parser.parse_pinyin_batch(texts)
+
+    def parse_jyutping_batch(self, texts):
+        return parser.parse_jyutping_batch(texts)
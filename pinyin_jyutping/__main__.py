@@ -0,0 +1,4 @@
+import sys
+from . import cli
+
+sys.exit(cli.main())
@@ -0,0 +1,144 @@
+import asyncio
+import weakref
+import functools
+import itertools
+import concurrent.futures
+import multiprocessing
+import logging
+
+from . import constants
+from . import parallel
+from . import cache
+
+logger = logging.getLogger(__file__)
+
+# asyncio facade
+# ==============
+#
+# conversion is cpu bound, called inline from a coroutine it blocks the event loop for the whole jieba and
+# render pass. AsyncConverter runs each conversion on an executor instead:
+#  - thread pool (default): the threads share the instance, its data and its result cache. the event loop
+#    keeps serving other requests, but conversions still take turns on the GIL.
+#  - process pool: spawned workers open the memory-mapped data file, whose pages are shared by the operating
+#    system, and replay the corrections of the instance, see parallel.initialize_spawned_worker. conversions
+#    use all the cores.
+# identical requests in flight at the same time are converted once, and at most max_pending conversions are
+# submitted to the executor at once: further callers wait for a slot, rather than queueing without bound.
+#
+# overlays (see PinyinJyutping.create_overlay) share the converter of their base instance, its executor and
+# its max_pending limit, and are passed along as the instance to convert with. the process pool workers
+# only replayed the corrections of the base instance: the ones of the overlay are sent with each conversion,
+# and each worker keeps the overlays it built for the last few of them.
+
+# overlays built in a process pool worker, (overlay id, data generation) -> PinyinJyutping
+worker_overlays = None
+
+def get_worker_overlay(overlay_key, overlay_corrections):
+    global worker_overlays
+    if worker_overlays == None:
+        worker_overlays = cache.LRUCache(constants.ASYNC_WORKER_OVERLAYS)
+    overlay = worker_overlays.get(overlay_key)
+    if overlay == None:
+        overlay = parallel.worker_instance.create_overlay()
+        parallel.replay_corrections(overlay, overlay_corrections)
+        worker_overlays.put(overlay_key, overlay)
+    return overlay
+
+def convert_in_worker(overlay_key, overlay_corrections, map_name, text, tone_numbers, spaces):
+    # runs in a process pool worker, see parallel.initialize_spawned_worker
+    if overlay_key == None:
+        return parallel.convert_chunk((map_name, [text], tone_numbers, spaces))[0]
+    overlay = get_worker_overlay(overlay_key, overlay_corrections)
+    if map_name == 'pinyin_map':
+        return overlay.pinyin(text, tone_numbers, spaces)
+    return overlay.jyutping(text, tone_numbers, spaces)
+
+class AsyncConverter():
+    def __init__(self, instance, executor=constants.Executor.thread, max_workers=None, max_pending=constants.ASYNC_MAX_PENDING):
+        self.instance = instance
+        self.executor_type = executor
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.executor = None
+        # data_generation() of the instance when the process pool workers replayed its corrections
+        self.executor_generation = 0
+        # asyncio objects belong to the event loop they were created in
+        self.loop = None
+        self.semaphore = None
+        self.in_flight = {}
+        # ids of the overlays converted on the process pool, the workers know them by it
+        self.overlay_ids = weakref.WeakKeyDictionary()
+        self.overlay_counter = itertools.count()
+
+    def get_executor(self):
+        if self.executor_type == constants.Executor.thread:
+            if self.executor == None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix='pinyin_jyutping')
+            return self.executor
+        if self.executor != None and self.executor_generation != self.instance.data_generation():
+            # corrections were loaded since the workers started, conversions already submitted still complete
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        if self.executor == None:
+            # forking a process which runs an event loop and threads isn't safe, always spawn
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=parallel.initialize_spawned_worker,
+                initargs=(parallel.spawned_worker_options(self.instance), self.instance.replayed_corrections()))
+            self.executor_generation = self.instance.data_generation()
+        return self.executor
+
+    def overlay_arguments(self, instance):
+        # returns the key the workers cache the overlay on, and its corrections on top of the base instance's
+        if instance is self.instance:
+            return None, None
+        overlay_id = self.overlay_ids.get(instance, None)
+        if overlay_id == None:
+            overlay_id = next(self.overlay_counter)
+            self.overlay_ids[instance] = overlay_id
+        overlay_corrections = instance.replayed_corrections()[len(self.instance.replayed_corrections()):]
+        return (overlay_id, instance.data_generation()), overlay_corrections
+
+    def conversion_function(self, instance, map_name, text, tone_numbers, spaces):
+        if self.executor_type == constants.Executor.process:
+            overlay_key, overlay_corrections = self.overlay_arguments(instance)
+            return functools.partial(convert_in_worker, overlay_key, overlay_corrections, map_name, text, tone_numbers, spaces)
+        if map_name == 'pinyin_map':
+            return functools.partial(instance.pinyin, text, tone_numbers, spaces)
+        return functools.partial(instance.jyutping, text, tone_numbers, spaces)
+
+    def set_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(self.max_pending)
+            self.in_flight = {}
+
+    async def run(self, instance, map_name, text, tone_numbers, spaces):
+        async with self.semaphore:
+            function = self.conversion_function(instance, map_name, text, tone_numbers, spaces)
+            return await self.loop.run_in_executor(self.get_executor(), function)
+
+    def conversion_done(self, in_flight, key, task):
+        if in_flight.get(key, None) is task:
+            del in_flight[key]
+        if not task.cancelled():
+            # the callers get the exception, don't let asyncio report it as never retrieved
+            task.exception()
+
+    async def convert(self, instance, map_name, text, tone_numbers, spaces):
+        # instance: the converter's instance, or an overlay of it
+        self.set_loop()
+        key = (instance, map_name, text, tone_numbers, spaces)
+        task = self.in_flight.get(key, None)
+        if task == None:
+            task = self.loop.create_task(self.run(instance, map_name, text, tone_numbers, spaces))
+            self.in_flight[key] = task
+            task.add_done_callback(functools.partial(self.conversion_done, self.in_flight, key))
+        # a caller getting cancelled doesn't cancel the conversion for the others waiting on it
+        return await asyncio.shield(task)
+
+    def shutdown(self, wait=True):
+        if self.executor != None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
@@ -1,4 +1,6 @@
 import logging
+import threading
+import collections
 from . import constants
 from . import logic
 from . import syllables
@@ -56,6 +58,8 @@ def jyutping_all_syllables_generator():
                     #     'syllable': syllable,
                     #     'pinyin': tone_marks
                     # }
+                    # not part of the map, but renders the tone marks once, see logic.jyutping_render_tone_mark
+                    syllable.render_tone_mark()
                     tone_numbers = syllable.render_tone_number()
                     yield {
                         'syllable': syllable,
@@ -75,5 +79,68 @@ def build_jyutping_syllable_map():
 
     return result_map, max_length
 
+# character trie over the keys of a syllable map: each node maps a character to the next node, and the node
+# reached at the end of a key holds the syllable under TRIE_SYLLABLE_KEY. the parser walks it to find the
+# longest syllable at a given position, without slicing the text.
+TRIE_SYLLABLE_KEY = None
+
+def build_syllables_trie(syllables_map):
+    trie = {}
+    for key, syllable in syllables_map.items():
+        node = trie
+        for character in key:
+            node = node.setdefault(character, {})
+        node[TRIE_SYLLABLE_KEY] = syllable
+    return trie
+
 PinyinSyllablesMap, PINYIN_SYLLABLE_MAX_LENGTH = build_pinyin_syllable_map()
-JyutpingSyllablesMap, JYUTPING_SYLLABLE_MAX_LENGTH = build_jyutping_syllable_map()
\ No newline at end of file
+JyutpingSyllablesMap, JYUTPING_SYLLABLE_MAX_LENGTH = build_jyutping_syllable_map()
+PinyinSyllablesTrie = build_syllables_trie(PinyinSyllablesMap)
+JyutpingSyllablesTrie = build_syllables_trie(JyutpingSyllablesMap)
+
+
+# result cache
+# ============
+
+class LRUCache():
+    """size-bounded, thread-safe least recently used cache, which keeps statistics to help size it"""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self.entries.get(key, self)
+            if value is self:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        # statistics are kept, they describe the traffic, not the content
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.entries),
+                'max_size': self.max_size
+            }
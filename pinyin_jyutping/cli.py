@@ -0,0 +1,84 @@
+import io
+import os
+import sys
+import argparse
+import logging
+
+from . import constants
+from . import PinyinJyutping
+
+logger = logging.getLogger(__file__)
+
+# command line conversion
+# =======================
+#
+# reads utf-8 text from a file or stdin, writes one converted line per input line, as it goes:
+#   cat subtitles.txt | pinyin-jyutping pinyin --tone-numbers > subtitles.pinyin.txt
+
+def build_argument_parser():
+    parser = argparse.ArgumentParser(prog='pinyin-jyutping', description='Convert Chinese text to Pinyin or Jyutping, line by line')
+    parser.add_argument('romanization', choices=['pinyin', 'jyutping'])
+    parser.add_argument('--tone-numbers', action='store_true', help='use tone numbers instead of tone marks')
+    parser.add_argument('--spaces', action='store_true', help='put spaces between all syllables')
+    parser.add_argument('--input', help='input file, stdin by default')
+    parser.add_argument('--output', help='output file, stdout by default')
+    parser.add_argument('--compact-data', action='store_true', help='use the memory-mapped dictionary')
+    parser.add_argument('--segmenter', choices=[segmenter.name for segmenter in constants.Segmenter], default=constants.Segmenter.jieba.name)
+    parser.add_argument('--tone-sandhi', nargs='*', choices=[mode.name for mode in constants.ToneSandhi],
+        default=[constants.TONE_SANDHI_DEFAULT.name], help='pinyin tone changes to apply')
+    parser.add_argument('--chunk-size', type=int, default=constants.STREAM_CHUNK_SIZE, help='number of lines converted together')
+    return parser
+
+def open_text(filepath, mode, standard_stream):
+    # newline='' keeps the line endings untouched, so that output lines match input lines
+    if filepath == None:
+        return io.TextIOWrapper(standard_stream.buffer, encoding='utf-8', newline='')
+    return open(filepath, mode, encoding='utf-8', newline='')
+
+def close_text(text_file, filepath):
+    if filepath != None:
+        text_file.close()
+        return
+    # closing the wrapper of a standard stream, or letting it get garbage collected, would close the
+    # stream's buffer too. detach it instead
+    try:
+        text_file.detach()
+    except BrokenPipeError:
+        pass
+
+def parse_tone_sandhi(names):
+    tone_sandhi = constants.TONE_SANDHI_NONE
+    for name in names:
+        tone_sandhi |= constants.ToneSandhi[name]
+    return tone_sandhi
+
+def main(argv=None):
+    args = build_argument_parser().parse_args(argv)
+    pinyin_jyutping = PinyinJyutping(compact_data=args.compact_data, lazy=True, segmenter=constants.Segmenter[args.segmenter],
+        tone_sandhi=parse_tone_sandhi(args.tone_sandhi))
+    if args.romanization == 'pinyin':
+        convert_stream = pinyin_jyutping.pinyin_stream
+    else:
+        convert_stream = pinyin_jyutping.jyutping_stream
+    input_file = open_text(args.input, 'r', sys.stdin)
+    output_file = open_text(args.output, 'w', sys.stdout)
+    try:
+        chunk_size = args.chunk_size
+        for index, line in enumerate(convert_stream(input_file, args.tone_numbers, args.spaces, chunk_size), 1):
+            output_file.write(line)
+            if index % chunk_size == 0:
+                # downstream commands in a pipeline see the output as soon as each chunk is done
+                output_file.flush()
+        output_file.flush()
+    except BrokenPipeError:
+        # output closed early, for example piped into head. nothing more can be written, point
+        # stdout at devnull so that the interpreter doesn't complain when flushing it on exit
+        sys.stdout = open(os.devnull, 'w')
+        return 0
+    finally:
+        close_text(input_file, args.input)
+        close_text(output_file, args.output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
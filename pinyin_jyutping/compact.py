@@ -0,0 +1,246 @@
+import sys
+import mmap
+import array
+import struct
+import functools
+import logging
+
+from . import constants
+from . import syllables
+from . import data
+from . import errors
+
+logger = logging.getLogger(__file__)
+
+# compact on-disk format for the pinyin / jyutping maps
+# =====================================================
+#
+# the file is memory-mapped read-only, so that all the processes using it share the same physical pages.
+# for each map, the following sections are stored (all integers are little endian):
+#  - syllable table: one line per distinct syllable, "initial final tone" enum names, the position is the syllable id
+#  - key offsets: uint32[key_count + 1], offsets into the key blob
+#  - key blob: utf-8 encoded keys, sorted by their utf-8 bytes, so we can binary search
+#  - entry offsets: uint32[key_count + 1], for each key, the range of mappings
+#  - mapping offsets: uint32[mapping_count + 1], for each mapping, the range of syllable ids
+#  - mapping occurences: uint32[mapping_count]
+#  - syllable ids: uint16[syllable_count]
+
+MAGIC = b'PJCD'
+VERSION = 1
+
+MAP_NAMES = ['pinyin_map', 'jyutping_map']
+SECTION_NAMES = ['syllable_table', 'key_offsets', 'keys', 'entry_offsets', 'mapping_offsets', 'mapping_occurences', 'syllable_ids']
+
+HEADER_FORMAT = '<4sI' + 'QQ' * len(SECTION_NAMES) * len(MAP_NAMES)
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+ALIGNMENT = 8
+
+# number of decoded entries kept around per map, lookups for the same words are very frequent
+LOOKUP_CACHE_SIZE = 65536
+
+
+def syllable_table_entry(syllable):
+    return f'{syllable.initial.name} {syllable.final.name} {syllable.tone.name}'
+
+def build_syllable_decoder(map_name):
+    if map_name == 'pinyin_map':
+        initials, finals, tones = constants.PinyinInitials, constants.PinyinFinals, constants.PinyinTones
+        build_syllable = syllables.build_pinyin_syllable
+    else:
+        initials, finals, tones = constants.JyutpingInitials, constants.JyutpingFinals, constants.JyutpingTones
+        build_syllable = syllables.build_jyutping_syllable
+    def decode(entry):
+        initial, final, tone = entry.split(' ')
+        return build_syllable(initials[initial], finals[final], tones[tone])
+    return decode
+
+def uint_array(typecode, values):
+    result = array.array(typecode, values)
+    if sys.byteorder != 'little':
+        result.byteswap()
+    return result.tobytes()
+
+def encode_word_map(word_map):
+    syllable_ids = {}
+    key_offsets = [0]
+    keys = bytearray()
+    entry_offsets = [0]
+    mapping_offsets = [0]
+    mapping_occurences = []
+    syllable_id_list = []
+    for key_bytes, key in sorted((key.encode('utf-8'), key) for key in word_map.keys()):
+        keys.extend(key_bytes)
+        key_offsets.append(len(keys))
+        for mapping in word_map[key]:
+            for syllable in mapping.syllables:
+                table_entry = syllable_table_entry(syllable)
+                syllable_id = syllable_ids.setdefault(table_entry, len(syllable_ids))
+                syllable_id_list.append(syllable_id)
+            mapping_offsets.append(len(syllable_id_list))
+            mapping_occurences.append(mapping.occurences)
+        entry_offsets.append(len(mapping_occurences))
+    return [
+        '\n'.join(syllable_ids.keys()).encode('utf-8'),
+        uint_array('I', key_offsets),
+        bytes(keys),
+        uint_array('I', entry_offsets),
+        uint_array('I', mapping_offsets),
+        uint_array('I', mapping_occurences),
+        uint_array('H', syllable_id_list),
+    ]
+
+def write_compact_data(data, filepath):
+    sections = []
+    for map_name in MAP_NAMES:
+        sections.extend(encode_word_map(getattr(data, map_name)))
+    header_values = []
+    body = bytearray()
+    position = HEADER_SIZE
+    for section in sections:
+        padding = -position % ALIGNMENT
+        body.extend(b'\0' * padding)
+        position += padding
+        header_values.extend([position, len(section)])
+        body.extend(section)
+        position += len(section)
+    with open(filepath, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, *header_values))
+        f.write(body)
+
+
+class CompactWordMap():
+    """read-only view over one map of a compact data file, with the same lookup interface as the dict
+    it replaces: word -> list of data.Mapping. words written to the map (user corrections) go to an
+    in-memory overlay which takes precedence over the file."""
+
+    def __init__(self, buffer, sections, decode_syllable):
+        self.buffer = buffer
+        self.key_offsets = self.uint_view(sections['key_offsets'], 'I')
+        self.keys_start = sections['keys'][0]
+        self.entry_offsets = self.uint_view(sections['entry_offsets'], 'I')
+        self.mapping_offsets = self.uint_view(sections['mapping_offsets'], 'I')
+        self.mapping_occurences = self.uint_view(sections['mapping_occurences'], 'I')
+        self.syllable_ids = self.uint_view(sections['syllable_ids'], 'H')
+        start, length = sections['syllable_table']
+        syllable_table = bytes(buffer[start:start + length]).decode('utf-8')
+        self.syllables = [decode_syllable(entry) for entry in syllable_table.split('\n')] if length > 0 else []
+        self.key_count = len(self.key_offsets) - 1
+        self.overlay = {}
+        self.cached_lookup = functools.lru_cache(maxsize=LOOKUP_CACHE_SIZE)(self.lookup)
+
+    def uint_view(self, section, typecode):
+        start, length = section
+        if sys.byteorder == 'little':
+            return memoryview(self.buffer)[start:start + length].cast(typecode)
+        # big endian host, can't share the pages, make a byte-swapped copy
+        result = array.array(typecode, bytes(self.buffer[start:start + length]))
+        result.byteswap()
+        return result
+
+    def key_at(self, index):
+        return self.buffer[self.keys_start + self.key_offsets[index]:self.keys_start + self.key_offsets[index + 1]]
+
+    def find(self, key_bytes):
+        low = 0
+        high = self.key_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key_at(middle) < key_bytes:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.key_count and self.key_at(low) == key_bytes:
+            return low
+        return None
+
+    def decode(self, index):
+        result = []
+        for mapping_index in range(self.entry_offsets[index], self.entry_offsets[index + 1]):
+            syllable_range = range(self.mapping_offsets[mapping_index], self.mapping_offsets[mapping_index + 1])
+            mapping = data.Mapping([self.syllables[self.syllable_ids[i]] for i in syllable_range])
+            mapping.occurences = self.mapping_occurences[mapping_index]
+            result.append(mapping)
+        return result
+
+    def lookup(self, key):
+        index = self.find(key.encode('utf-8'))
+        if index == None:
+            return None
+        return self.decode(index)
+
+    def get(self, key, default=None):
+        entry = self.overlay.get(key, None)
+        if entry == None:
+            entry = self.cached_lookup(key)
+        if entry == None:
+            return default
+        return entry
+
+    def __getitem__(self, key):
+        # the caller may modify the entry in place, so hand out a private copy
+        # which lives in the overlay
+        entry = self.overlay.get(key, None)
+        if entry == None:
+            entry = self.lookup(key)
+            if entry == None:
+                raise KeyError(key)
+            self.overlay[key] = entry
+        return entry
+
+    def __setitem__(self, key, value):
+        self.overlay[key] = value
+
+    def __contains__(self, key):
+        return key in self.overlay or self.cached_lookup(key) != None
+
+    def __iter__(self):
+        for index in range(self.key_count):
+            yield bytes(self.key_at(index)).decode('utf-8')
+        for key in self.overlay:
+            if self.find(key.encode('utf-8')) == None:
+                yield key
+
+    def keys(self):
+        return iter(self)
+
+    def __len__(self):
+        return self.key_count + len([key for key in self.overlay if self.find(key.encode('utf-8')) == None])
+
+
+def open_compact_file(filepath):
+    """memory-map the file, returns the buffer and the sections of each map"""
+    f = open(filepath, 'rb')
+    try:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+    if len(buffer) < HEADER_SIZE:
+        raise errors.DataFormatError(f'{filepath} is too small to be a compact data file')
+    header = struct.unpack(HEADER_FORMAT, buffer[0:HEADER_SIZE])
+    magic, version, section_values = header[0], header[1], header[2:]
+    if magic != MAGIC or version != VERSION:
+        raise errors.DataFormatError(f'{filepath}: unsupported format {magic} version {version}')
+    map_sections = {}
+    section_index = 0
+    for map_name in MAP_NAMES:
+        sections = {}
+        for section_name in SECTION_NAMES:
+            sections[section_name] = (section_values[section_index], section_values[section_index + 1])
+            section_index += 2
+        map_sections[map_name] = sections
+    return buffer, map_sections
+
+class CompactData():
+    def __init__(self, filepath):
+        self.buffer, map_sections = open_compact_file(filepath)
+        for map_name in MAP_NAMES:
+            word_map = CompactWordMap(self.buffer, map_sections[map_name], build_syllable_decoder(map_name))
+            setattr(self, map_name, word_map)
+
+def load_compact_data(filepath):
+    return CompactData(filepath)
+
+def load_compact_word_map(filepath, map_name):
+    # only the sections of this map get touched
+    buffer, map_sections = open_compact_file(filepath)
+    return CompactWordMap(buffer, map_sections[map_name], build_syllable_decoder(map_name))
@@ -1,10 +1,62 @@
 import enum
 
-PICKLE_DATA_FILENAME='pinyin_jyutping.pkl'
+# memory-mapped alternative to the pickles, see compact.py
+COMPACT_DATA_FILENAME='pinyin_jyutping.dat'
+# one pickle per map, so that lazy loading only pays for the map which is used
+PINYIN_MAP_PICKLE_DATA_FILENAME='pinyin_jyutping_pinyin_map.pkl'
+JYUTPING_MAP_PICKLE_DATA_FILENAME='pinyin_jyutping_jyutping_map.pkl'
+JIEBA_DICTIONARY_FILENAME='dict.txt.big'
+# prebuilt jieba prefix dictionary, see tokenizer.py
+JIEBA_CACHE_FILENAME='dict.txt.big.cache'
+
+# word segmentation engine used during conversion
+class Segmenter(enum.Enum):
+    jieba = 1 # jieba, followed by a second pass to break down words missing from the dictionary
+    dag   = 2 # built-in segmenter, max probability path over the words of the pinyin / jyutping map
+
+# pinyin tone sandhi applied to the most probable solution, combine with |
+class ToneSandhi(enum.Flag):
+    bu_yi      = enum.auto() # 不 and 一 before a fourth tone become second tone
+    yi         = enum.auto() # 一 (yi1) before a first, second or third tone becomes fourth tone, ordinals aren't detected
+    third_tone = enum.auto() # third tone before a third tone becomes second tone, 3-3-3 becomes 2-2-3
+TONE_SANDHI_DEFAULT = ToneSandhi.bu_yi
+# jyutping conversion, the rules are for pinyin tones
+TONE_SANDHI_NONE = ToneSandhi(0)
+
+# where the async API (apinyin / ajyutping) runs conversions
+class Executor(enum.Enum):
+    thread  = 1 # thread pool, sharing the instance
+    process = 2 # pool of spawned processes, sharing the memory-mapped data file
+
+# correction files, see import_pinyin_corrections
+class CorrectionFormat(enum.Enum):
+    json = 1 # list of objects: {"chinese": ..., "pinyin": ...}
+    csv  = 2 # header row with the column names: chinese,pinyin
 
 # by default, we'll try to return all possible solutions. however the number of combinations
 # quickly explodes with long inputs. if we exceed this number of words, just return the most likely solution.
 MULTI_SOLUTION_MAX_WORD_COUNT = 50
+# the solutions generators only enumerate this many combinations of the readings of each character, when
+# breaking down a word into characters
+MULTI_SOLUTION_MAX_CHARACTER_COMBINATIONS = 1000
+
+# streaming conversion: number of lines converted together, the lookups are shared within a chunk.
+# memory use is bounded by the chunk, not the input.
+STREAM_CHUNK_SIZE = 1000
+# parallel conversion: number of texts sent to a worker process at once, large enough that the
+# inter-process overhead doesn't matter
+PARALLEL_CHUNK_SIZE = 500
+# async conversion: number of conversions submitted to the executor at the same time, further callers wait
+ASYNC_MAX_PENDING = 64
+# async conversion on a process pool: number of overlays each worker keeps, see asynchronous.py
+ASYNC_WORKER_OVERLAYS = 16
+# conversion server: port, and the requests of concurrent clients get converted together, up to this many,
+# waiting at most this long (in seconds) for them to come in
+SERVER_PORT = 8700
+SERVER_BATCH_MAX_SIZE = 256
+SERVER_BATCH_MAX_DELAY = 0.002
+# upper bounds of the latency histogram buckets, in milliseconds
+SERVER_LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
 
 class PinyinInitials(enum.Enum):
     b  =  1
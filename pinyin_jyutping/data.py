@@ -1,3 +1,4 @@
+import threading
 
 class Mapping():
     def __init__(self, syllables):
@@ -13,4 +14,92 @@ class Data():
         self.jyutping_map = {}
 
     def __str_(self):
-        return f'{self.word_map}, {self.character_map}'
\ No newline at end of file
+        return f'{self.word_map}, {self.character_map}'
+
+class LazyData():
+    """same interface as Data, but each map is only loaded the first time it gets accessed"""
+    def __init__(self, pinyin_map_loader, jyutping_map_loader):
+        self.loaders = {
+            'pinyin_map': pinyin_map_loader,
+            'jyutping_map': jyutping_map_loader
+        }
+        self.maps = {}
+        self.lock = threading.Lock()
+
+    def load_map(self, map_name):
+        word_map = self.maps.get(map_name, None)
+        if word_map == None:
+            with self.lock:
+                if map_name not in self.maps:
+                    self.maps[map_name] = self.loaders[map_name]()
+                word_map = self.maps[map_name]
+        return word_map
+
+    def is_loaded(self, map_name):
+        return map_name in self.maps
+
+    @property
+    def pinyin_map(self):
+        return self.load_map('pinyin_map')
+
+    @property
+    def jyutping_map(self):
+        return self.load_map('jyutping_map')
+
+class OverlayWordMap():
+    """word map layered over a base word map, which it never modifies: words written to it (corrections)
+    shadow the entries of the base map. lookups consult the overlay first, then the base."""
+    def __init__(self, base):
+        self.base = base
+        self.entries = {}
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key, None)
+        if entry == None:
+            return self.base.get(key, default)
+        return entry
+
+    def __getitem__(self, key):
+        entry = self.entries.get(key, None)
+        if entry == None:
+            return self.base[key]
+        return entry
+
+    def __setitem__(self, key, value):
+        self.entries[key] = value
+
+    def __contains__(self, key):
+        return key in self.entries or key in self.base
+
+    def __iter__(self):
+        yield from self.base
+        for key in self.entries:
+            if key not in self.base:
+                yield key
+
+    def keys(self):
+        return iter(self)
+
+    def __len__(self):
+        return len(self.base) + len([key for key in self.entries if key not in self.base])
+
+class OverlayData():
+    """same interface as Data, each map is an OverlayWordMap over the map of the base data, created on
+    first access (a LazyData base only loads the maps which get used). overlays can be stacked."""
+    def __init__(self, base):
+        self.base = base
+        self.maps = {}
+
+    def overlay_map(self, map_name):
+        word_map = self.maps.get(map_name, None)
+        if word_map == None:
+            word_map = self.maps.setdefault(map_name, OverlayWordMap(getattr(self.base, map_name)))
+        return word_map
+
+    @property
+    def pinyin_map(self):
+        return self.overlay_map('pinyin_map')
+
+    @property
+    def jyutping_map(self):
+        return self.overlay_map('jyutping_map')
@@ -4,3 +4,5 @@ class PinyinParsingError(Exception):
 class PinyinSyllableNotFound(PinyinParsingError):
     pass
 
+class DataFormatError(Exception):
+    pass
@@ -0,0 +1,62 @@
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__file__)
+
+# conversion instrumentation
+# ==========================
+#
+# a ConversionStats object given to PinyinJyutping accumulates the wall time spent in each stage of the
+# conversion, and counters describing the input. conversion functions take stats=None, and only look at the
+# clock when they're given one, so there is no cost when instrumentation is disabled.
+
+STAGES = [
+    'tokenize', # jieba, or the dictionary segmenter
+    'improve_tokenization', # second pass over the jieba tokens
+    'lookup', # dictionary lookup, character by character when a word isn't found
+    'tone_change', # tone sandhi
+    'render', # tone marks or tone numbers
+]
+
+COUNTERS = [
+    'conversions', # texts converted
+    'words_looked_up',
+    'character_fallbacks', # chinese words not in the dictionary, converted character by character
+    'pass_through_syllables', # characters without a reading, output as they are
+    'solutions_enumerated', # solutions considered for each word, or for the whole text with the solutions generator
+]
+
+class ConversionStats():
+    """per-stage wall time, in seconds, and counters, accumulated over all the conversions of an instance.
+    callback, if given, is called with the name of each stage and its duration, as it's recorded."""
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stage_times = {stage: 0.0 for stage in STAGES}
+            self.counters = {counter: 0 for counter in COUNTERS}
+
+    def record_stage(self, stage, start_time):
+        # returns the end time, which is the start time of the next stage
+        end_time = time.perf_counter()
+        duration = end_time - start_time
+        with self.lock:
+            self.stage_times[stage] += duration
+        if self.callback != None:
+            self.callback(stage, duration)
+        return end_time
+
+    def increment(self, counter, count=1):
+        with self.lock:
+            self.counters[counter] += count
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'stage_times': dict(self.stage_times),
+                'counters': dict(self.counters)
+            }
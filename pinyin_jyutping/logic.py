@@ -1,3 +1,4 @@
+import bisect
 import functools
 import logging
 import copy
@@ -76,6 +77,19 @@ def get_initial_str(initial):
         result = initial.name
     return result
 
+# after j, q, x, ü is written u
+JQX_FINAL_MAPPINGS = {
+        constants.PinyinFinals.v: 'u',
+        constants.PinyinFinals.ve: 'ue',
+        constants.PinyinFinals.van: 'uan',
+        constants.PinyinFinals.vn: 'un',
+}
+SPECIAL_FINAL_MAPPINGS = {
+    constants.PinyinInitials.j: JQX_FINAL_MAPPINGS,
+    constants.PinyinInitials.q: JQX_FINAL_MAPPINGS,
+    constants.PinyinInitials.x: JQX_FINAL_MAPPINGS
+}
+
 def get_final_str(initial, final):
     result = final.final_text()
     if initial == constants.PinyinInitials.empty:
@@ -103,28 +117,21 @@ def get_final_str(initial, final):
         elif result[0] == 'ü':
             result = 'yu' + result[1:]
 
-    jqx_mappings = {
-            constants.PinyinFinals.v: 'u',
-            constants.PinyinFinals.ve: 'ue',
-            constants.PinyinFinals.van: 'uan',
-            constants.PinyinFinals.vn: 'un',            
-    }
-    special_mappings = {
-        constants.PinyinInitials.j: jqx_mappings,        
-        constants.PinyinInitials.q: jqx_mappings,
-        constants.PinyinInitials.x: jqx_mappings
-    }
-    altered_final = special_mappings.get(initial, {}).get(final, None)
+    altered_final = SPECIAL_FINAL_MAPPINGS.get(initial, {}).get(final, None)
     if altered_final != None:
         return altered_final
 
     return result
 
+# rendering is in the innermost loop of every conversion. the syllable inventory is small, so the renderers
+# are memoized, and cache.py renders every valid syllable at import time: after that, rendering is a lookup.
+@functools.lru_cache(maxsize=None)
 def render_tone_mark(initial, final, tone):
     # logger.warning(f'render_tone_mark {initial} {final}')
     result = f'{get_initial_str(initial)}{apply_tone_mark(initial, final, tone)}'
     return result
 
+@functools.lru_cache(maxsize=None)
 def render_tone_number(initial, final, tone, final_variant=None):
     final_str = get_final_str(initial, final)
     if final_variant != None:
@@ -206,6 +213,7 @@ def jyutping_get_initial_str(initial):
         initial_str = ''
     return initial_str
 
+@functools.lru_cache(maxsize=None)
 def jyutping_render_tone_number(initial, final, tone):
     final_str = final.name
     if final == constants.JyutpingFinals.in_:
@@ -222,78 +230,114 @@ def jyutping_apply_tone_mark(final, tone):
     if location == None:
         # no vowels, return as-is (could be m or ng)
         return final_str
-    logger.debug(f'final_str: {final_str} location: {location}')
+    logger.debug('final_str: %s location: %s', final_str, location)
     vowel = final_str[location]
     tone_mark_vowel = constants.JyutpingVowelToneMap[vowel][tone]
     with_tone = final_str.replace(vowel, tone_mark_vowel, 1) # only replace the first one
     return with_tone
 
+@functools.lru_cache(maxsize=None)
 def jyutping_render_tone_mark(initial, final, tone):
     # logger.warninjg(f'render_tone_mark {initial} {final}')
     result = f'{jyutping_get_initial_str(initial)}{jyutping_apply_tone_mark(final, tone)}'
     return result
 
-def solution_generator(word_list, solutions_array):
-    word_index = 0
-    prev_chinese_character = None
-    for word, word_solutions in zip(word_list, solutions_array):
-        # add the current word length
-        word_solution_index = 0
-        word_solution = word_solutions[0]
-        character_index = 0
-        for chinese_character, syllable in zip(word, word_solution):
-            data = {
-                'prev_chinese_character': prev_chinese_character,
-                'word_index': word_index,
-                'word_solution_index': word_solution_index,
-                'character_index': character_index,
-                'chinese_character': chinese_character,
-                'syllable': syllable
-            }
-            prev_chinese_character = data['chinese_character']
-            yield data
-            character_index += 1
-        word_index += 1
-
-def solution_change_tone(solutions_array, word_index, word_solution_index, character_index, new_tone):
-    logger.debug(f'solution_change_tone: word_index: {word_index} word_solution_index: {word_solution_index}: character_index: {character_index}, new_tone: {new_tone}')
-    word_copy = copy.copy(solutions_array[word_index][word_solution_index])
-    syllable_copy = copy.copy(word_copy[character_index]) 
-    syllable_copy.tone = new_tone
-
-    word_copy[character_index] = syllable_copy
-    solutions_array[word_index][word_solution_index] = word_copy
-
-def apply_pinyin_tone_change(word_list, solutions_array):
-    # note: pinyin tone change can really only be applied on the most likely solution
-    # otherwise, it gets very complicated
-    logger.debug(f'solutions_array before: {pprint.pformat(solutions_array)}')
-    for character in solution_generator(word_list, solutions_array):
-        logger.debug(f'processing character: {pprint.pformat(character)}')
-        prev_chinese_character = character['prev_chinese_character']
-        if prev_chinese_character == '不':
-            if character['syllable'].tone == constants.PinyinTones.tone_4:
-                logger.debug(f'performing tone change, 不 tone 4 to tone 2')
-                solution_change_tone(solutions_array, 
-                                    prev_character['word_index'], 
-                                    prev_character['word_solution_index'], 
-                                    prev_character['character_index'], 
-                                    constants.PinyinTones.tone_2)
-        elif prev_chinese_character == '一':
-            if character['syllable'].tone == constants.PinyinTones.tone_4:
-                logger.debug(f'performing tone change, 一 tone 4 to tone 2')
-                solution_change_tone(solutions_array, 
-                                        prev_character['word_index'], 
-                                        prev_character['word_solution_index'], 
-                                        prev_character['character_index'], 
-                                        constants.PinyinTones.tone_2)
-            else:
-                # doesn't seem to be universally applied
-                #solution_change_tone(solution, prev_character['word_index'], prev_character['character_index'], constants.PinyinTones.tone_4)
-                pass
+# tone sandhi
+# ===========
+#
+# rules are a table: (mode, character, tone of the character, tone of the next syllable, new tone of the
+# character), None for any character or any tone. the most probable solution is flattened into a string of
+# characters and a parallel array of syllables, the positions where a rule could apply are located in one
+# pass, and all rules are evaluated on the dictionary tones. only the syllable list of a word which has a
+# syllable changed gets copied.
+
+TONE_SANDHI_RULES = [
+    (constants.ToneSandhi.bu_yi, '不', None, constants.PinyinTones.tone_4, constants.PinyinTones.tone_2),
+    (constants.ToneSandhi.bu_yi, '一', None, constants.PinyinTones.tone_4, constants.PinyinTones.tone_2),
+    (constants.ToneSandhi.yi, '一', constants.PinyinTones.tone_1, constants.PinyinTones.tone_1, constants.PinyinTones.tone_4),
+    (constants.ToneSandhi.yi, '一', constants.PinyinTones.tone_1, constants.PinyinTones.tone_2, constants.PinyinTones.tone_4),
+    (constants.ToneSandhi.yi, '一', constants.PinyinTones.tone_1, constants.PinyinTones.tone_3, constants.PinyinTones.tone_4),
+    (constants.ToneSandhi.third_tone, None, constants.PinyinTones.tone_3, constants.PinyinTones.tone_3, constants.PinyinTones.tone_2),
+]
 
+@functools.lru_cache(maxsize=None)
+def tone_sandhi_rules(tone_sandhi):
+    """for the enabled modes: {(character, tone, next tone): new tone} and {(tone, next tone): new tone}
+    for the rules which apply to any character"""
+    character_rules = {}
+    any_character_rules = {}
+    for mode, character, tone, next_tone, new_tone in TONE_SANDHI_RULES:
+        if not (mode & tone_sandhi):
+            continue
+        tones = [tone]
+        if tone == None:
+            tones = list(constants.PinyinTones)
+        for tone in tones:
+            if character == None:
+                any_character_rules[(tone, next_tone)] = new_tone
+            else:
+                character_rules[(character, tone, next_tone)] = new_tone
+    return character_rules, any_character_rules
 
-        prev_character = character
+def find_all(text, character):
+    position = text.find(character)
+    while position != -1:
+        yield position
+        position = text.find(character, position + 1)
 
-    logger.debug(f'solutions_array after: {pprint.pformat(solutions_array)}')
-    return solutions_array
\ No newline at end of file
+def apply_pinyin_tone_change(word_list, solutions_array, tone_sandhi=constants.TONE_SANDHI_DEFAULT):
+    # note: pinyin tone change can really only be applied on the most likely solution
+    # otherwise, it gets very complicated
+    character_rules, any_character_rules = tone_sandhi_rules(tone_sandhi)
+    if len(character_rules) == 0 and len(any_character_rules) == 0:
+        return solutions_array
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
+    if debug_enabled:
+        logger.debug(f'solutions_array before: {pprint.pformat(solutions_array)}')
+    # the characters of the whole text, and the syllables of the most probable solution, as flat arrays.
+    # word_starts maps a position back to its word.
+    characters = []
+    flat_syllables = []
+    word_starts = []
+    for word, word_solutions in zip(word_list, solutions_array):
+        word_solution = word_solutions[0]
+        length = min(len(word), len(word_solution))
+        word_starts.append(len(flat_syllables))
+        characters.append(word[:length])
+        flat_syllables.extend(word_solution[:length])
+    characters = ''.join(characters)
+    # positions where a rule could apply: the characters of the character rules (found by str.find, the
+    # other characters aren't looked at), and the tones of the rules for any character
+    positions = set()
+    for character in set([character for character, tone, next_tone in character_rules.keys()]):
+        positions.update(find_all(characters, character))
+    if len(any_character_rules) > 0:
+        rule_tones = set([tone for tone, next_tone in any_character_rules.keys()])
+        positions.update([position for position, syllable in enumerate(flat_syllables) if syllable.tone in rule_tones])
+    # all the rules look at the dictionary tones, so the changes are only applied once they're all known
+    changes = []
+    for position in sorted(positions):
+        if position + 1 >= len(flat_syllables):
+            continue
+        tone = flat_syllables[position].tone
+        next_tone = flat_syllables[position + 1].tone
+        new_tone = character_rules.get((characters[position], tone, next_tone), None)
+        if new_tone == None:
+            new_tone = any_character_rules.get((tone, next_tone), None)
+        if new_tone != None:
+            changes.append((position, new_tone))
+    copied_word_indexes = set()
+    for position, new_tone in changes:
+        word_index = bisect.bisect_right(word_starts, position) - 1
+        character_index = position - word_starts[word_index]
+        logger.debug('performing tone change, %s to %s before %s', characters[position], new_tone, flat_syllables[position + 1].tone)
+        word_solutions = solutions_array[word_index]
+        if word_index not in copied_word_indexes:
+            # the word's syllable list may be shared with the dictionary
+            word_solutions[0] = copy.copy(word_solutions[0])
+            copied_word_indexes.add(word_index)
+        word_solutions[0][character_index] = word_solutions[0][character_index].with_tone(new_tone)
+
+    if debug_enabled:
+        logger.debug(f'solutions_array after: {pprint.pformat(solutions_array)}')
+    return solutions_array
@@ -0,0 +1,109 @@
+import os
+import gc
+import multiprocessing
+import logging
+
+from . import constants
+from . import conversion
+
+logger = logging.getLogger(__file__)
+
+# parallel conversion
+# ===================
+#
+# conversion is pure python, so a single instance only ever uses one core. for large batches, the input
+# is cut into chunks which are converted by a pool of worker processes, each one running the batch API.
+#
+# the workers must not each load the dictionary from scratch:
+#  - with the fork start method (linux), the parent's instance is inherited by the workers, copy-on-write.
+#    gc.freeze() moves everything allocated so far out of the garbage collector's reach, otherwise the first
+#    collection in each worker would touch (and so copy) every page of the dictionary.
+#  - with spawn (windows, macos by default), each worker opens the memory-mapped data file, whose pages are
+#    shared by the operating system, whichever data the parent uses, and replays the corrections which were
+#    applied to the parent. if the data file is missing, the workers fall back to loading the pickles.
+# either way, the worker instance is set by the pool initializer, which also runs in the workers the pool
+# starts to replace the ones which exit.
+
+# instance used by the conversion function in worker processes
+worker_instance = None
+
+def initialize_forked_worker(instance):
+    global worker_instance
+    worker_instance = instance
+
+def compact_data_available():
+    filepath = os.path.join(os.path.dirname(__file__), constants.COMPACT_DATA_FILENAME)
+    if os.path.exists(filepath):
+        return True
+    logger.warning(f'{filepath} not found, each spawned worker process loads the pickled dictionary')
+    return False
+
+def spawned_worker_options(instance):
+    return {
+        'compact_data': compact_data_available(),
+        'segmenter': instance.segmenter,
+        'tone_sandhi': instance.tone_sandhi
+    }
+
+def initialize_spawned_worker(options, corrections):
+    global worker_instance
+    from . import PinyinJyutping
+    worker_instance = PinyinJyutping(compact_data=options['compact_data'], lazy=True, segmenter=options['segmenter'], tone_sandhi=options['tone_sandhi'])
+    replay_corrections(worker_instance, corrections)
+
+def replay_corrections(instance, corrections):
+    # corrections: (map name, corrections), see PinyinJyutping.replayed_corrections
+    for map_name, correction_list in corrections:
+        if map_name == 'pinyin_map':
+            instance.load_pinyin_corrections(correction_list)
+        else:
+            instance.load_jyutping_corrections(correction_list)
+
+def convert_chunk(arguments):
+    map_name, texts, tone_numbers, spaces = arguments
+    if map_name == 'pinyin_map':
+        return worker_instance.pinyin_batch(texts, tone_numbers, spaces)
+    return worker_instance.jyutping_batch(texts, tone_numbers, spaces)
+
+def get_start_method(start_method):
+    if start_method != None:
+        return start_method
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return 'fork'
+    return 'spawn'
+
+def create_pool(instance, map_name, processes, start_method):
+    context = multiprocessing.get_context(start_method)
+    if start_method != 'fork':
+        return context.Pool(processes, initializer=initialize_spawned_worker, initargs=(spawned_worker_options(instance), instance.replayed_corrections()))
+    # load everything the workers will need before forking, so that it's done once, in the parent
+    getattr(instance.data, map_name)
+    instance.get_tokenizer(map_name)
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    gc.freeze()
+    try:
+        # with fork, the initializer arguments are inherited, not pickled
+        return context.Pool(processes, initializer=initialize_forked_worker, initargs=(instance,))
+    finally:
+        gc.unfreeze()
+        if gc_enabled:
+            gc.enable()
+
+def convert_parallel(instance, map_name, texts, tone_numbers, spaces, processes=None, chunk_size=constants.PARALLEL_CHUNK_SIZE, start_method=None):
+    """converts texts (any iterable) across a pool of processes, returns the results in input order"""
+    start_method = get_start_method(start_method)
+    result = []
+    pool = create_pool(instance, map_name, processes, start_method)
+    try:
+        arguments = ((map_name, chunk, tone_numbers, spaces) for chunk in conversion.iterate_chunks(texts, chunk_size))
+        # imap hands out chunks as workers free up, and returns them in order
+        for converted in pool.imap(convert_chunk, arguments):
+            result.extend(converted)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return result
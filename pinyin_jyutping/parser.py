@@ -1,3 +1,6 @@
+import os
+import csv
+import json
 import logging
 import pprint
 import re
@@ -18,7 +21,7 @@ def parse_romanization(text, syllables_map, max_length):
     # look for initial
     original_text = text
 
-    logger.debug(f'looking for pinyin syllable in {text}')
+    logger.debug('looking for pinyin syllable in %s', text)
     # pprint.pprint(cache.PinyinFinalsMap)    
     for candidate_length in reversed(range(max_length + 1)):
         candidate = text[0:candidate_length]
@@ -30,42 +33,162 @@ def parse_romanization(text, syllables_map, max_length):
     raise errors.PinyinSyllableNotFound(f"couldn't find pinyin syllable: {text} [{original_text}]")
 
 
-def parse_romanized_word(text, syllables_map, max_length):
+def scan_romanized_word(text, syllables_trie):
+    """clean once, then a single left to right scan, taking the longest syllable at each position.
+    doesn't raise: returns (syllables, None), or (syllables found so far, position of the first
+    character which doesn't start a syllable) in the cleaned text"""
     syllables = []
-    while len(clean_romanization(text)) > 0:
-        logger.debug(f'parsing pinyin word: {text}')
-        # remove leading space
-        text = clean_romanization(text)
-        syllable, text = parse_romanization(text, syllables_map, max_length)
-        logger.debug(f'parsed {syllable}, remaining text: {text}')
+    position = 0
+    length = len(text)
+    while position < length:
+        if text[position].isspace():
+            position += 1
+            continue
+        node = syllables_trie
+        syllable = None
+        end = position
+        for index in range(position, length):
+            node = node.get(text[index], None)
+            if node == None:
+                break
+            candidate = node.get(cache.TRIE_SYLLABLE_KEY, None)
+            if candidate != None:
+                syllable = candidate
+                end = index + 1
+        if syllable == None:
+            return syllables, position
         syllables.append(syllable)
+        position = end
+    return syllables, None
+
+def parse_romanized_word(text, syllables_trie):
+    text = clean_romanization(text)
+    syllables, error_position = scan_romanized_word(text, syllables_trie)
+    if error_position != None:
+        raise errors.PinyinSyllableNotFound(f"couldn't find pinyin syllable: {text[error_position:]} [{text}]")
     return syllables
 
 def parse_pinyin(text):
-    return parse_romanized_word(text, cache.PinyinSyllablesMap, cache.PINYIN_SYLLABLE_MAX_LENGTH)
+    return parse_romanized_word(text, cache.PinyinSyllablesTrie)
 
 def parse_jyutping(text):
-    return parse_romanized_word(text, cache.JyutpingSyllablesMap, cache.JYUTPING_SYLLABLE_MAX_LENGTH)
+    return parse_romanized_word(text, cache.JyutpingSyllablesTrie)
+
+# applied in order, after lowercasing and stripping leading whitespace
+ROMANIZATION_REPLACEMENTS = [
+    (',', ''),
+    ('，', ''),
+    ('、', ''),
+    ('·', ''),
+    ('？', ' '),
+    ('！', ' '),
+    ('。', ' '),
+    ('/', ' '),
+    ('...', ' '),
+    ('…', ' '),
+    ('.', ''),
+    ('“', ''),
+    ('”', ''),
+    ('  ', ' '),
+]
 
 def clean_romanization(text):
     text = text.lower()
     text = text.lstrip()
-    text = text.replace(',', '')
-    text = text.replace('，', '')
-    text = text.replace('、', '')
-    text = text.replace('·', '')
-    text = text.replace('？', ' ')
-    text = text.replace('！', ' ')
-    text = text.replace('。', ' ')
-    text = text.replace('/', ' ')
-    text = text.replace('...', ' ')
-    text = text.replace('…', ' ')
-    text = text.replace('.', '')
-    text = text.replace('“', '')
-    text = text.replace('”', '')
-    text = text.replace('  ', ' ')    
+    for old, new in ROMANIZATION_REPLACEMENTS:
+        text = text.replace(old, new)
     return text
- 
+
+def clean_romanization_with_offsets(text):
+    """same as clean_romanization, also returns, for each character of the cleaned text, its position in
+    the original text. slower, only used to report errors"""
+    characters = []
+    offsets = []
+    for offset, character in enumerate(text):
+        for lower_character in character.lower():
+            characters.append(lower_character)
+            offsets.append(offset)
+    while len(characters) > 0 and characters[0].isspace():
+        del characters[0]
+        del offsets[0]
+    for old, new in ROMANIZATION_REPLACEMENTS:
+        replaced_characters = []
+        replaced_offsets = []
+        index = 0
+        while index < len(characters):
+            if ''.join(characters[index:index + len(old)]) == old:
+                replaced_characters.extend(new)
+                replaced_offsets.extend([offsets[index]] * len(new))
+                index += len(old)
+            else:
+                replaced_characters.append(characters[index])
+                replaced_offsets.append(offsets[index])
+                index += 1
+        characters = replaced_characters
+        offsets = replaced_offsets
+    return ''.join(characters), offsets
+
+# romanization parsing API
+# ========================
+
+def render_syllables(syllables):
+    return {
+        'tone_numbers': ' '.join([syllable.render_tone_number() for syllable in syllables]),
+        'tone_marks': ' '.join([syllable.render_tone_mark() for syllable in syllables])
+    }
+
+def parse_romanization_result(text, syllables_trie):
+    cleaned_text = clean_romanization(text)
+    syllables, error_position = scan_romanized_word(cleaned_text, syllables_trie)
+    if error_position == None:
+        result = {'syllables': syllables, 'error': None}
+        result.update(render_syllables(syllables))
+        return result
+    # the unrecognized span goes up to the next space, locate it in the original text
+    error_end = error_position
+    while error_end < len(cleaned_text) and not cleaned_text[error_end].isspace():
+        error_end += 1
+    cleaned_text, offsets = clean_romanization_with_offsets(text)
+    start = offsets[error_position]
+    end = offsets[error_end - 1] + 1
+    return {
+        'syllables': None,
+        'tone_numbers': None,
+        'tone_marks': None,
+        'error': {'start': start, 'end': end, 'text': text[start:end]}
+    }
+
+def parse_romanization_batch(texts, syllables_trie):
+    """parses each text into syllables, without raising. for each text, returns a dict with the syllables and
+    their tone_numbers / tone_marks renderings, or with an error: start and end offsets in the text of the
+    part which couldn't be parsed. identical texts are only parsed once."""
+    results = {}
+    output = []
+    for text in texts:
+        result = results.get(text, None)
+        if result == None:
+            result = parse_romanization_result(text, syllables_trie)
+            results[text] = result
+        else:
+            # each duplicate gets its own copy, the caller may modify them
+            result = copy_romanization_result(result)
+        output.append(result)
+    return output
+
+def copy_romanization_result(result):
+    result = dict(result)
+    if result['syllables'] != None:
+        result['syllables'] = list(result['syllables'])
+    if result['error'] != None:
+        result['error'] = dict(result['error'])
+    return result
+
+def parse_pinyin_batch(texts):
+    return parse_romanization_batch(texts, cache.PinyinSyllablesTrie)
+
+def parse_jyutping_batch(texts):
+    return parse_romanization_batch(texts, cache.JyutpingSyllablesTrie)
+
 def clean_chinese(text):
     text = text.strip()
     text = text.replace(',', '')
@@ -92,15 +215,21 @@ def parse_cedict_file_generator(filepath):
                 yield line
 
 def parse_cedict_entries(generator, data):
+    apply_word_additions(cedict_word_additions_generator(generator), data)
+
+def cedict_word_additions_generator(generator):
+    # yields the (map name, chinese, syllables) additions for each cedict line, see word_additions
     for line in generator:
         try:
             simplified, traditional, syllables = parse_cedict_line_decode_pinyin(line)
             if (len(simplified) != len(syllables)) or (len(traditional) != len(syllables)):
                 raise errors.PinyinParsingError(f'inconsistent lengths for line {line}')
-            process_word(simplified, syllables, data.pinyin_map)
-            process_word(traditional, syllables, data.pinyin_map)
+            additions = word_additions(simplified, syllables) + word_additions(traditional, syllables)
         except errors.PinyinParsingError as e:
             logger.warning(e)
+            continue
+        for chinese, word_syllables in additions:
+            yield 'pinyin_map', chinese, word_syllables
 
 def parse_pinyin_correction(chinese, pinyin, data):
     chinese = clean_chinese(chinese)
@@ -114,7 +243,7 @@ def parse_jyutping_correction(chinese, jyutping, data):
 
 # returns raw pinyin text
 def parse_cedict_line(line):
-    logger.debug(f'parsing cedict line: {line}')
+    logger.debug('parsing cedict line: %s', line)
     m = re.match('(.+)\s\[([^\]]*)\]\s\/([^\/]+)\/.*', line)
     if m == None:
         logger.info(line)
@@ -157,8 +286,11 @@ def parse_cccanto_line_generator(filepath):
                 yield line
 
 def parse_cccanto_definition_generator(filepath):
-    for line in parse_cccanto_line_generator(filepath):
-        logger.debug(f'parsing cedict line: {line}')
+    return parse_cccanto_definition_lines(parse_cccanto_line_generator(filepath))
+
+def parse_cccanto_definition_lines(lines):
+    for line in lines:
+        logger.debug('parsing cedict line: %s', line)
         m = re.match('(.+)\s\[([^\]]*)\]\s\{([^\]]*)\}\s\/([^\/]+)\/.*', line)
         if m == None:
             logger.error(f'could not parse line: {line}')
@@ -181,7 +313,10 @@ def parse_cccanto_definition_generator(filepath):
         }
         
 def parse_cccedit_canto_readings_generator(filepath):
-    for line in parse_cccanto_line_generator(filepath):
+    return parse_cccedit_canto_readings_lines(parse_cccanto_line_generator(filepath))
+
+def parse_cccedit_canto_readings_lines(lines):
+    for line in lines:
         m = re.match('(.+)\s\[([^\]]*)\]\s\{([^\]]*)\}.*', line)
         if m == None:
             logger.error(f'could not parse line: {line}')
@@ -209,7 +344,13 @@ def parse_jyutping_ccedit_canto_readings_process_words(filepath, data):
     return parse_jyutping_process_words(parse_cccedit_canto_readings_generator, filepath, data)
 
 def parse_jyutping_process_words(generator, filepath, data):
-    for entry in generator(filepath):
+    apply_word_additions(jyutping_word_additions_generator(generator, filepath), data)
+
+def jyutping_word_additions_generator(generator, filepath):
+    return jyutping_entries_word_additions_generator(generator(filepath))
+
+def jyutping_entries_word_additions_generator(entries):
+    for entry in entries:
         jyutping = entry['jyutping']
         simplified = entry['simplified_chinese']
         traditional = entry['traditional_chinese']
@@ -218,17 +359,132 @@ def parse_jyutping_process_words(generator, filepath, data):
             # do some sanity checks on the length of syllables
             if (len(simplified) != len(syllables)) or (len(traditional) != len(syllables)):
                 raise errors.PinyinParsingError(f'inconsistent lengths for jyutping {jyutping} simplified {simplified} traditional {traditional}')
-            process_word(simplified, syllables, data.jyutping_map)
-            process_word(traditional, syllables, data.jyutping_map)
+            additions = word_additions(simplified, syllables) + word_additions(traditional, syllables)
         except errors.PinyinParsingError as e:
-            logger.warning(e)            
-
-def process_word(chinese, syllables, map, add_full_text=True, add_tokenized_words=True, add_characters=True, priority=False):
-    # this is the sorting key
-    def get_occurences(x):
-        return x.occurences
-
-    def add_word_mapping(chinese, word_map, syllables, priority):
+            logger.warning(e)
+            continue
+        for chinese, word_syllables in additions:
+            yield 'jyutping_map', chinese, word_syllables
+
+def jyutping_cccanto_definition_word_additions_generator(filepath):
+    return jyutping_word_additions_generator(parse_cccanto_definition_generator, filepath)
+
+def jyutping_ccedit_canto_readings_word_additions_generator(filepath):
+    return jyutping_word_additions_generator(parse_cccedit_canto_readings_generator, filepath)
+
+# the same, starting from lines, which is how the sources get sharded across processes
+def cccanto_definition_lines_word_additions_generator(lines):
+    return jyutping_entries_word_additions_generator(parse_cccanto_definition_lines(lines))
+
+def cccedit_canto_readings_lines_word_additions_generator(lines):
+    return jyutping_entries_word_additions_generator(parse_cccedit_canto_readings_lines(lines))
+
+def apply_word_additions(additions, data, priority=False):
+    # additions: (map name, chinese, syllables), applied in order, the order matters for words
+    # which end up with the same number of occurences
+    accumulators = {}
+    for map_name, chinese, syllables in additions:
+        accumulator = accumulators.get(map_name, None)
+        if accumulator == None:
+            accumulator = WordMapAccumulator(getattr(data, map_name))
+            accumulators[map_name] = accumulator
+        accumulator.add(chinese, syllables, priority)
+    for accumulator in accumulators.values():
+        accumulator.finalize()
+
+# bulk corrections
+# ================
+#
+# all the entries are parsed and segmented first, then applied to the map in a single WordMapAccumulator
+# finalize, instead of one finalize (and sort of the word's mappings) per entry. entries which can't be
+# parsed are reported, not raised.
+
+CORRECTION_FIELDS = {
+    'pinyin_map': 'pinyin',
+    'jyutping_map': 'jyutping'
+}
+
+def read_correction_stream(f, file_format):
+    if file_format == constants.CorrectionFormat.json:
+        return json.load(f)
+    return csv.DictReader(f)
+
+def read_correction_file(filepath, file_format):
+    with open(filepath, 'r', encoding='utf-8-sig', newline='') as f:
+        yield from read_correction_stream(f, file_format)
+
+def read_correction_entries(source, file_format=None):
+    """source: path of a json or csv file (format taken from the extension unless given), open file object
+    (format required), or an iterable of entries, returned as it is"""
+    if isinstance(source, (str, os.PathLike)):
+        if file_format == None:
+            extension = os.path.splitext(source)[1].lstrip('.').lower()
+            if extension not in constants.CorrectionFormat.__members__:
+                raise ValueError(f'unknown correction file format: {source}')
+            file_format = constants.CorrectionFormat[extension]
+        return read_correction_file(source, file_format)
+    if hasattr(source, 'read'):
+        if file_format == None:
+            raise ValueError('file_format is required to read corrections from a file object')
+        return read_correction_stream(source, file_format)
+    return source
+
+def correction_entries_word_additions(map_name, entries, parse_function):
+    """parses all the entries, returns the word additions of the valid ones, the valid entries, and the
+    rejected ones: {'index', 'entry', 'error'}"""
+    field = CORRECTION_FIELDS[map_name]
+    additions = []
+    accepted = []
+    rejected = []
+    # decks often contain the same entry more than once, it only needs to be segmented once
+    entry_additions_cache = {}
+    for index, entry in enumerate(entries):
+        try:
+            chinese = clean_chinese(entry['chinese'])
+            romanization = entry[field]
+            key = (chinese, romanization)
+            entry_additions = entry_additions_cache.get(key, None)
+            if entry_additions == None:
+                syllables = parse_function(romanization)
+                if len(chinese) == 0 or len(chinese) != len(syllables):
+                    raise errors.PinyinParsingError(f'inconsistent lengths: {chinese}, {romanization}')
+                entry_additions = [(map_name, chinese_word, word_syllables) for chinese_word, word_syllables in word_additions(chinese, syllables)]
+                entry_additions_cache[key] = entry_additions
+        except (KeyError, TypeError, AttributeError, errors.PinyinParsingError) as e:
+            rejected.append({'index': index, 'entry': entry, 'error': f'{type(e).__name__}: {e}'})
+            continue
+        accepted.append(entry)
+        additions.extend(entry_additions)
+    return additions, accepted, rejected
+
+class WordMapAccumulator():
+    """collects word mappings for a word map, then writes them in a single finalize pass.
+
+    mappings are counted in a dict keyed on the syllable tuple, instead of scanning and re-sorting the word's
+    mapping list on every insert. the final order is the one repeated stable sorts by decreasing occurences
+    would give: by occurences, then by the time the mapping reached its current count. words which are already
+    in the map are seeded from it, in their current order."""
+
+    def __init__(self, word_map):
+        self.word_map = word_map
+        # word -> {syllable tuple: [occurences, timestamp, syllables]}
+        self.words = {}
+        self.timestamp = 0
+
+    def next_timestamp(self):
+        self.timestamp += 1
+        return self.timestamp
+
+    def word_entries(self, chinese):
+        entries = self.words.get(chinese, None)
+        if entries == None:
+            entries = {}
+            for mapping in self.word_map.get(chinese, []):
+                entries[tuple(mapping.syllables)] = [mapping.occurences, self.next_timestamp(), mapping.syllables]
+            self.words[chinese] = entries
+        return entries
+
+    def add(self, chinese, syllables, priority=False):
         # if DEBUG_WORD != None:
         #     if chinese == DEBUG_WORD:
         #         logger.warn(f'adding word mapping: {chinese} syllable: {syllables}')
@@ -236,34 +492,44 @@ def process_word(chinese, syllables, map, add_full_text=True, add_tokenized_word
         if len(chinese) != len(syllables):
             raise Exception(f'{chinese} and {syllables}: inconsistent lengths')
 
-        # insert into word map
-        if chinese not in word_map:
-            # will be initialized with occurences = 1
+        entries = self.word_entries(chinese)
+        key = tuple(syllables)
+        entry = entries.get(key, None)
+        if entry == None:
+            occurences = 1
+            if priority and len(entries) > 0:
+                occurences = constants.OCCURENCES_MAX
+            # for a new word, the mapping is initialized with occurences = 1
             # in priority mode, this is fine, it will be the only choice
-            word_map[chinese] = [data.Mapping(syllables)]
-        else:
-            # does this pinyin exist already ?
-            matching_entries = [x for x in word_map[chinese] if x.syllables == syllables]
-            if len(matching_entries) == 1:
-                # we already have this pinyin
-                if priority:
-                    matching_entries[0].occurences = constants.OCCURENCES_MAX
-                else:
-                    matching_entries[0].occurences += 1 
-            elif len(matching_entries) == 0:
-                # need to insert
-                word_map[chinese].append(data.Mapping(syllables))
-                if priority:
-                    word_map[chinese][-1].occurences = constants.OCCURENCES_MAX
-            else:
-                pprint.pprint(word_map[chinese])
-                raise Exception(f'found {len(matching_entries)} entries for [{chinese}], while processing {syllables}')
-            word_map[chinese].sort(key=get_occurences, reverse=True)
-
-
+            entries[key] = [occurences, self.next_timestamp(), syllables]
+            return
+        occurences = constants.OCCURENCES_MAX if priority else entry[0] + 1
+        if occurences > entry[0]:
+            # goes after the mappings which already have that many occurences
+            entry[1] = self.next_timestamp()
+        elif occurences < entry[0]:
+            # it was ahead of all of them, and stays ahead
+            entry[1] = -self.next_timestamp()
+        entry[0] = occurences
+
+    def finalize(self):
+        for chinese, entries in self.words.items():
+            mappings = []
+            for occurences, timestamp, syllables in sorted(entries.values(), key=lambda entry: (-entry[0], entry[1])):
+                mapping = data.Mapping(syllables)
+                mapping.occurences = occurences
+                mappings.append(mapping)
+            self.word_map[chinese] = mappings
+        self.words = {}
+
+def word_additions(chinese, syllables, add_full_text=True, add_tokenized_words=True, add_characters=True):
+    """list of (chinese, syllables) word mappings to add for this entry: the full text, each word after
+    jieba segmentation, and each character. this is the expensive part of ingestion, the result only
+    depends on the entry and the jieba dictionary."""
+    result = []
     if add_full_text:
         # insert into word mapping
-        add_word_mapping(chinese, map, syllables, priority)
+        result.append((chinese, syllables))
     if add_tokenized_words:
         # add each word after jieba segmentation
         word_list = conversion.tokenize(chinese)
@@ -273,13 +539,17 @@ def process_word(chinese, syllables, map, add_full_text=True, add_tokenized_word
             word_list = word_list[1:]
             syllables_for_word = remaining_syllables[0:len(chinese_word)]
             remaining_syllables = remaining_syllables[len(chinese_word):]
-            add_word_mapping(chinese_word, map, syllables_for_word, priority)
+            result.append((chinese_word, syllables_for_word))
     if add_characters:
         # add each character
         if len(chinese) != len(syllables):
             raise Exception(f'found inconsistent lengths: {chinese}, {syllables}')
         for chinese_char, syllable in zip(chinese, syllables):
-            add_word_mapping(chinese_char, map, [syllable], priority)
+            result.append((chinese_char, [syllable]))
+    return result
 
-
-        
+def process_word(chinese, syllables, map, add_full_text=True, add_tokenized_words=True, add_characters=True, priority=False):
+    accumulator = WordMapAccumulator(map)
+    for chinese_word, word_syllables in word_additions(chinese, syllables, add_full_text, add_tokenized_words, add_characters):
+        accumulator.add(chinese_word, word_syllables, priority)
+    accumulator.finalize()
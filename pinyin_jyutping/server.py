@@ -0,0 +1,302 @@
+import sys
+import json
+import time
+import queue
+import bisect
+import argparse
+import threading
+import http.server
+import concurrent.futures
+import logging
+
+from . import constants
+from . import instrumentation
+from . import cli
+from . import PinyinJyutping
+
+logger = logging.getLogger(__file__)
+
+# conversion server
+# =================
+#
+# one process keeps the dictionary and jieba warm, and serves any number of local clients over HTTP/JSON:
+#   pinyin-jyutping-server --port 8700
+#   curl -d '{"text": "没有", "tone_numbers": true}' http://localhost:8700/pinyin
+#
+# each request is handled in its own thread. single solution conversions are handed to a batcher thread,
+# which waits a little (max_delay) for concurrent requests to come in, and converts all of them with one call
+# to the batch API, sharing the lookups. all-solutions and parse requests are converted directly.
+#
+#  POST /pinyin, /jyutping                            {"text", "tone_numbers", "spaces"} -> {"result"}
+#  POST /pinyin_all_solutions, /jyutping_all_solutions {"text", "tone_numbers", "spaces"} -> {"result"}
+#  POST /parse_pinyin, /parse_jyutping                {"texts"} -> {"result"}, see parser.parse_romanization_batch,
+#                                                     with the syllables as tone number strings
+#  GET  /stats                                        latency histograms, batching and conversion stats
+
+class LatencyHistogram():
+    """request count per latency bucket, bounds in milliseconds, the last bucket is unbounded"""
+    def __init__(self, bounds=constants.SERVER_LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, duration):
+        milliseconds = duration * 1000
+        with self.lock:
+            self.counts[bisect.bisect_left(self.bounds, milliseconds)] += 1
+            self.total += milliseconds
+
+    def as_dict(self):
+        with self.lock:
+            count = sum(self.counts)
+            labels = [f'<={bound}' for bound in self.bounds] + [f'>{self.bounds[-1]}']
+            return {
+                'count': count,
+                'mean_ms': self.total / count if count > 0 else None,
+                'buckets_ms': dict(zip(labels, self.counts))
+            }
+
+class ConversionBatcher():
+    """collects the single solution conversion requests of concurrent clients, and converts them together"""
+    def __init__(self, instance, max_batch_size=constants.SERVER_BATCH_MAX_SIZE, max_delay=constants.SERVER_BATCH_MAX_DELAY):
+        self.instance = instance
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+        self.batch_count = 0
+        self.text_count = 0
+        self.thread = threading.Thread(target=self.run, name='pinyin_jyutping_batcher', daemon=True)
+        self.thread.start()
+
+    def convert(self, map_name, text, tone_numbers, spaces):
+        future = concurrent.futures.Future()
+        self.requests.put(((map_name, tone_numbers, spaces), text, future))
+        return future.result()
+
+    def stop(self):
+        self.requests.put(None)
+        self.thread.join()
+
+    def next_batch(self):
+        request = self.requests.get()
+        if request == None:
+            return None
+        batch = [request]
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request == None:
+                # stopping, convert what we have first
+                self.requests.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch == None:
+                return
+            # requests with the same options are converted together
+            groups = {}
+            for options, text, future in batch:
+                groups.setdefault(options, []).append((text, future))
+            for (map_name, tone_numbers, spaces), requests in groups.items():
+                self.convert_group(map_name, tone_numbers, spaces, requests)
+            self.batch_count += 1
+            self.text_count += len(batch)
+
+    def convert_batch(self, map_name, texts, tone_numbers, spaces):
+        if map_name == 'pinyin_map':
+            return self.instance.pinyin_batch(texts, tone_numbers, spaces)
+        return self.instance.jyutping_batch(texts, tone_numbers, spaces)
+
+    def convert_group(self, map_name, tone_numbers, spaces, requests):
+        texts = [text for text, future in requests]
+        try:
+            results = self.convert_batch(map_name, texts, tone_numbers, spaces)
+        except Exception as e:
+            if len(requests) == 1:
+                requests[0][1].set_exception(e)
+                return
+            # don't fail the other requests of the batch, convert the texts one by one
+            # so that each request gets its own result or exception
+            for text, future in requests:
+                try:
+                    future.set_result(self.convert_batch(map_name, [text], tone_numbers, spaces)[0])
+                except Exception as e:
+                    future.set_exception(e)
+            return
+        for result, (text, future) in zip(results, requests):
+            future.set_result(result)
+
+    def stats(self):
+        return {
+            'batches': self.batch_count,
+            'texts': self.text_count,
+            'mean_batch_size': self.text_count / self.batch_count if self.batch_count > 0 else None
+        }
+
+class ConversionServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, instance, max_batch_size=constants.SERVER_BATCH_MAX_SIZE, max_delay=constants.SERVER_BATCH_MAX_DELAY):
+        super().__init__(address, RequestHandler)
+        self.instance = instance
+        self.batcher = ConversionBatcher(instance, max_batch_size, max_delay)
+        self.histograms = {path: LatencyHistogram() for path in ENDPOINTS}
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.stop()
+
+    def stats(self):
+        result = {
+            'latency': {path: histogram.as_dict() for path, histogram in self.histograms.items()},
+            'batching': self.batcher.stats(),
+            'conversion': None
+        }
+        if self.instance.stats != None:
+            result['conversion'] = self.instance.stats.as_dict()
+        return result
+
+# requests are validated before they're queued, a bad request must not fail the batch it would be converted with
+
+def check_type(name, value, expected_type):
+    if not isinstance(value, expected_type):
+        raise TypeError(f'{name} must be of type {expected_type.__name__}, got {type(value).__name__}')
+
+def conversion_options(request):
+    check_type('request', request, dict)
+    text = request['text']
+    tone_numbers = request.get('tone_numbers', False)
+    spaces = request.get('spaces', False)
+    check_type('text', text, str)
+    check_type('tone_numbers', tone_numbers, bool)
+    check_type('spaces', spaces, bool)
+    return text, tone_numbers, spaces
+
+def parse_texts(request):
+    check_type('request', request, dict)
+    texts = request['texts']
+    check_type('texts', texts, list)
+    for text in texts:
+        check_type('text', text, str)
+    return texts
+
+def handle_pinyin(server, request):
+    return server.batcher.convert('pinyin_map', *conversion_options(request))
+
+def handle_jyutping(server, request):
+    return server.batcher.convert('jyutping_map', *conversion_options(request))
+
+def handle_pinyin_all_solutions(server, request):
+    return server.instance.pinyin_all_solutions(*conversion_options(request))
+
+def handle_jyutping_all_solutions(server, request):
+    return server.instance.jyutping_all_solutions(*conversion_options(request))
+
+def serializable_parse_result(result):
+    # syllables as tone number strings
+    if result['syllables'] == None:
+        return result
+    return dict(result, syllables=[str(syllable) for syllable in result['syllables']])
+
+def serializable_parse_results(results):
+    return [serializable_parse_result(result) for result in results]
+
+def handle_parse_pinyin(server, request):
+    return serializable_parse_results(server.instance.parse_pinyin_batch(parse_texts(request)))
+
+def handle_parse_jyutping(server, request):
+    return serializable_parse_results(server.instance.parse_jyutping_batch(parse_texts(request)))
+
+ENDPOINTS = {
+    '/pinyin': handle_pinyin,
+    '/jyutping': handle_jyutping,
+    '/pinyin_all_solutions': handle_pinyin_all_solutions,
+    '/jyutping_all_solutions': handle_jyutping_all_solutions,
+    '/parse_pinyin': handle_parse_pinyin,
+    '/parse_jyutping': handle_parse_jyutping,
+}
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status, content):
+        body = json.dumps(content, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send_json(404, {'error': f'unknown endpoint {self.path}'})
+            return
+        self.send_json(200, self.server.stats())
+
+    def do_POST(self):
+        start_time = time.perf_counter()
+        handler = ENDPOINTS.get(self.path, None)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if handler == None:
+            self.send_json(404, {'error': f'unknown endpoint {self.path}'})
+            return
+        status, content = self.handle_request(handler, body)
+        # recorded before responding, once a client has its response, the request shows up in /stats
+        self.server.histograms[self.path].record(time.perf_counter() - start_time)
+        self.send_json(status, content)
+
+    def handle_request(self, handler, body):
+        try:
+            request = json.loads(body.decode('utf-8'))
+            result = handler(self.server, request)
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {'error': f'invalid request: {e!r}'}
+        except Exception as e:
+            logger.exception(e)
+            return 500, {'error': repr(e)}
+        return 200, {'result': result}
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+def build_argument_parser():
+    parser = argparse.ArgumentParser(prog='pinyin-jyutping-server', description='Serve Pinyin and Jyutping conversion over local HTTP/JSON')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=constants.SERVER_PORT)
+    parser.add_argument('--compact-data', action='store_true', help='use the memory-mapped dictionary')
+    parser.add_argument('--segmenter', choices=[segmenter.name for segmenter in constants.Segmenter], default=constants.Segmenter.jieba.name)
+    parser.add_argument('--tone-sandhi', nargs='*', choices=[mode.name for mode in constants.ToneSandhi],
+        default=[constants.TONE_SANDHI_DEFAULT.name], help='pinyin tone changes to apply')
+    parser.add_argument('--max-batch-size', type=int, default=constants.SERVER_BATCH_MAX_SIZE, help='number of requests converted together')
+    parser.add_argument('--max-delay', type=float, default=constants.SERVER_BATCH_MAX_DELAY, help='seconds to wait for concurrent requests to batch with')
+    return parser
+
+def main(argv=None):
+    args = build_argument_parser().parse_args(argv)
+    instance = PinyinJyutping(compact_data=args.compact_data, segmenter=constants.Segmenter[args.segmenter],
+        stats=instrumentation.ConversionStats(), tone_sandhi=cli.parse_tone_sandhi(args.tone_sandhi))
+    instance.warmup_jieba()
+    server = ConversionServer((args.host, args.port), instance, args.max_batch_size, args.max_delay)
+    print(f'serving on http://{args.host}:{server.server_address[1]}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
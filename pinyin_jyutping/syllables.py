@@ -3,23 +3,51 @@ from . import constants
 import functools
 
 
-class PinyinSyllable():
+# syllables are immutable and interned: there is exactly one instance for each initial / final / tone
+# combination, always obtained through build_pinyin_syllable / build_jyutping_syllable. the dictionary holds
+# millions of references to a few thousand of them, so they use __slots__, and each one carries a stable
+# small integer id (from the enum declaration order) and its precomputed hash. pickling goes through the
+# builder, so unpickled syllables are interned too.
+
+def enum_indexes(enum_class):
+    return {member: index for index, member in enumerate(enum_class)}
+
+class Syllable():
+    __slots__ = ['initial', 'final', 'tone', 'syllable_id', 'hash_value']
+
     def __init__(self, initial, final, tone):
-        self.initial = initial
-        self.final = final
-        self.tone = tone
+        self.set_fields(initial, final, tone)
 
-    def get_initial_str(self):
-        result = ''
-        if self.initial != constants.PinyinInitials.empty:
-            result = self.initial.name
-        return result
+    def set_fields(self, initial, final, tone):
+        object.__setattr__(self, 'initial', initial)
+        object.__setattr__(self, 'final', final)
+        object.__setattr__(self, 'tone', tone)
+        syllable_id = (self.initial_indexes[initial] * len(self.final_indexes) + self.final_indexes[final]) * len(self.tone_indexes) + self.tone_indexes[tone]
+        object.__setattr__(self, 'syllable_id', syllable_id)
+        object.__setattr__(self, 'hash_value', hash((type(self).__name__, syllable_id)))
 
-    def render_tone_mark(self):
-        return logic.render_tone_mark(self.initial, self.final, self.tone)
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable, use with_tone to get a different tone')
 
-    def render_tone_number(self, final_variant=None):
-        return logic.render_tone_number(self.initial, self.final, self.tone, final_variant=final_variant)
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def with_tone(self, tone):
+        # tone sandhi: the sibling syllable, not a copy
+        return self.builder(self.initial, self.final, tone)
+
+    def __reduce__(self):
+        return (self.builder, (self.initial, self.final, self.tone))
+
+    def __setstate__(self, state):
+        # pickles written before syllables had __slots__ carry the attributes in a dict. the object was created
+        # by the unpickler, not the builder, so it isn't the interned instance, see intern_syllables
+        if isinstance(state, tuple):
+            state = state[1]
+        self.set_fields(state['initial'], state['final'], state['tone'])
+
+    def interned(self):
+        return self.builder(self.initial, self.final, self.tone)
 
     def __repr__(self):
         return f'{self.initial.name}-{self.final.name}-{self.tone.tone_number}'
@@ -27,12 +55,38 @@ class PinyinSyllable():
     def __str__(self):
         return self.render_tone_number()
 
+    def __hash__(self):
+        return self.hash_value
+
     def __eq__(self, other):
-        if other == None:
+        if self is other:
+            return True
+        if type(other) is not type(self):
             return False
-        return self.initial == other.initial and \
-               self.final == other.final and \
-               self.tone == other.tone
+        return self.syllable_id == other.syllable_id
+
+
+class PinyinSyllable(Syllable):
+    __slots__ = []
+    initial_indexes = enum_indexes(constants.PinyinInitials)
+    final_indexes = enum_indexes(constants.PinyinFinals)
+    tone_indexes = enum_indexes(constants.PinyinTones)
+
+    @staticmethod
+    def builder(initial, final, tone):
+        return build_pinyin_syllable(initial, final, tone)
+
+    def get_initial_str(self):
+        result = ''
+        if self.initial != constants.PinyinInitials.empty:
+            result = self.initial.name
+        return result
+
+    def render_tone_mark(self):
+        return logic.render_tone_mark(self.initial, self.final, self.tone)
+
+    def render_tone_number(self, final_variant=None):
+        return logic.render_tone_number(self.initial, self.final, self.tone, final_variant=final_variant)
 
 
 # for characters we don't recognize, just pass them through
@@ -52,11 +106,15 @@ class PassThroughSyllable():
 def build_pinyin_syllable(initial, final, tone):
     return PinyinSyllable(initial, final, tone)
 
-class JyutpingSyllable():
-    def __init__(self, initial, final, tone):
-        self.initial = initial
-        self.final = final
-        self.tone = tone
+class JyutpingSyllable(Syllable):
+    __slots__ = []
+    initial_indexes = enum_indexes(constants.JyutpingInitials)
+    final_indexes = enum_indexes(constants.JyutpingFinals)
+    tone_indexes = enum_indexes(constants.JyutpingTones)
+
+    @staticmethod
+    def builder(initial, final, tone):
+        return build_jyutping_syllable(initial, final, tone)
 
     def render_tone_mark(self):
         return logic.jyutping_render_tone_mark(self.initial, self.final, self.tone)
@@ -64,19 +122,25 @@ class JyutpingSyllable():
     def render_tone_number(self):
         return logic.jyutping_render_tone_number(self.initial, self.final, self.tone)
 
-    def __repr__(self):
-        return f'{self.initial.name}-{self.final.name}-{self.tone.tone_number}'
-
-    def __str__(self):
-        return self.render_tone_number()
-
-    def __eq__(self, other):
-        if other == None:
-            return False
-        return self.initial == other.initial and \
-               self.final == other.final and \
-               self.tone == other.tone
-
 @functools.lru_cache(maxsize=None)
 def build_jyutping_syllable(initial, final, tone):
-    return JyutpingSyllable(initial, final, tone)
\ No newline at end of file
+    return JyutpingSyllable(initial, final, tone)
+
+def first_syllable(word_map):
+    for entry in word_map.values():
+        for mapping in entry:
+            for syllable in mapping.syllables:
+                if isinstance(syllable, Syllable):
+                    return syllable
+    return None
+
+def intern_syllables(word_map):
+    """a word map unpickled from a pickle written before syllables were interned holds a new object for every
+    syllable. replaces them with the interned instances, returns False if the map didn't need it"""
+    syllable = first_syllable(word_map)
+    if syllable == None or syllable is syllable.interned():
+        return False
+    for entry in word_map.values():
+        for mapping in entry:
+            mapping.syllables = [syllable.interned() if isinstance(syllable, Syllable) else syllable for syllable in mapping.syllables]
+    return True
@@ -0,0 +1,211 @@
+import os
+import re
+import math
+import hashlib
+import tempfile
+import marshal
+import logging
+import jieba
+
+logger = logging.getLogger(__file__)
+
+# jieba prefix dictionary cache
+# =============================
+#
+# on first use, jieba parses its dictionary and builds a prefix dictionary (FREQ / total). unless it finds
+# a valid cache in the temp directory, this takes seconds with dict.txt.big. we ship a prebuilt cache next to
+# the dictionary and load it directly, so that warming up the tokenizer is a single read, and doesn't depend
+# on /tmp being writable or populated.
+
+# the cache is keyed on the hash of the dictionary: an edited dictionary of the same size must not get a stale
+# cache. hashing dict.txt.big on every warmup would cost more than the rest of the load though, so the cache also
+# stores the size and modification time of the dictionary at build time, and the hash is only computed when they
+# don't match. the dictionary gets a new modification time when the package is installed or checked out, the
+# shipped cache is left alone (it may not be writable, or tracked by git): a small file in the temp directory,
+# like jieba's own cache, records the size and modification time for which the hash was last found to match.
+JIEBA_CACHE_FORMAT_VERSION = 3
+
+def hash_dictionary(dictionary_filepath):
+    sha256 = hashlib.sha256()
+    with open(dictionary_filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def dictionary_stat_key(dictionary_filepath):
+    stat = os.stat(dictionary_filepath)
+    return (stat.st_size, stat.st_mtime_ns)
+
+def verified_key_filepath(cache_filepath):
+    cache_id = hashlib.md5(os.path.abspath(cache_filepath).encode('utf-8')).hexdigest()
+    return os.path.join(tempfile.gettempdir(), f'pinyin_jyutping.{cache_id}.verified')
+
+def read_verified_key(cache_filepath):
+    try:
+        with open(verified_key_filepath(cache_filepath), 'rb') as f:
+            return marshal.loads(f.read())
+    except Exception:
+        return None
+
+def write_verified_key(cache_filepath, verified_key):
+    try:
+        with open(verified_key_filepath(cache_filepath), 'wb') as f:
+            marshal.dump(verified_key, f)
+    except OSError as e:
+        logger.debug(f'could not record jieba cache verification for {cache_filepath}: {e}')
+
+def build_jieba_cache(dictionary_filepath, cache_filepath):
+    tokenizer = jieba.Tokenizer(dictionary_filepath)
+    freq, total = tokenizer.gen_pfdict(tokenizer.get_dict_file())
+    dictionary_hash = hash_dictionary(dictionary_filepath)
+    with open(cache_filepath, 'wb') as f:
+        marshal.dump((JIEBA_CACHE_FORMAT_VERSION, dictionary_hash, dictionary_stat_key(dictionary_filepath), freq, total), f)
+
+def load_jieba_cache(dictionary_filepath, cache_filepath):
+    """initialize jieba from the prebuilt cache, returns False if the cache is missing or doesn't
+    match the dictionary, in which case jieba should be initialized the regular way"""
+    if not os.path.isfile(cache_filepath):
+        return False
+    try:
+        with open(cache_filepath, 'rb') as f:
+            # reading the whole file first is much faster than marshal.load on the file object
+            format_version, dictionary_hash, stat_key, freq, total = marshal.loads(f.read())
+    except Exception as e:
+        logger.warning(f'could not load jieba cache {cache_filepath}: {e}')
+        return False
+    if format_version != JIEBA_CACHE_FORMAT_VERSION:
+        logger.warning(f'jieba cache {cache_filepath} has format {format_version}, ignoring')
+        return False
+    current_stat_key = dictionary_stat_key(dictionary_filepath)
+    verified_key = (dictionary_hash, current_stat_key)
+    if stat_key != current_stat_key and read_verified_key(cache_filepath) != verified_key:
+        if dictionary_hash != hash_dictionary(dictionary_filepath):
+            logger.warning(f'jieba cache {cache_filepath} does not match {dictionary_filepath}, ignoring')
+            return False
+        write_verified_key(cache_filepath, verified_key)
+    tokenizer = jieba.dt
+    with tokenizer.lock:
+        tokenizer.dictionary = os.path.abspath(dictionary_filepath)
+        tokenizer.FREQ = freq
+        tokenizer.total = total
+        tokenizer.initialized = True
+    return True
+
+# dictionary segmenter
+# ====================
+#
+# alternative to jieba, driven by the words of a pinyin / jyutping map. like jieba, builds a prefix dictionary
+# (every prefix of every word is present, with a weight of 0 if it's not a word itself), which serves as a trie
+# to build the DAG of all the words in the sentence, then picks the maximum probability path in a single
+# right-to-left pass. since the words come from the map we'll convert with, there's no need for the second
+# tokenization pass that jieba requires (conversion.improve_tokenization)
+
+# same blocks as jieba: runs of chinese and alphanumeric characters get segmented, everything else is
+# split on whitespace and passed through one character at a time
+CHINESE_CHARACTERS = '\u3400-\u4DBF\u4E00-\u9FFF\uF900-\uFAFF\U00020000-\U0002FA1F'
+RE_BLOCK = re.compile(f'([{CHINESE_CHARACTERS}a-zA-Z0-9+#&\\._%\\-]+)')
+RE_SKIP = re.compile('(\r\n|\\s)')
+RE_CHINESE_CHARACTER = re.compile(f'[{CHINESE_CHARACTERS}]')
+RE_CHINESE_RUN = re.compile(f'([{CHINESE_CHARACTERS}]+)')
+# numbers and latin words are kept together, again like jieba
+RE_ALPHANUMERIC = re.compile('([a-zA-Z0-9]+(?:\\.\\d+)?%?)')
+
+class DagTokenizer():
+    def __init__(self, word_map, base=None):
+        # base: the tokenizer of the map under a data.OverlayWordMap. only the words of the overlay get
+        # counted, the frequencies of the base tokenizer are looked up next, they aren't copied
+        self.base = base
+        self.freq = {}
+        # occurences of a word or word prefix (0), None for the other fragments
+        self.lookup = self.freq.get
+        words = word_map.keys()
+        total = 0
+        if base != None:
+            self.lookup = self.overlay_lookup
+            words = word_map.entries.keys()
+            total = base.total
+        for word in words:
+            occurences = sum([mapping.occurences for mapping in word_map.get(word)])
+            # the overlay replaces the word's mappings in the base
+            total += occurences - (self.lookup(word) or 0)
+            self.freq[word] = occurences
+            for i in range(1, len(word)):
+                prefix = word[:i]
+                if self.lookup(prefix) == None:
+                    self.freq[prefix] = 0
+        self.total = total
+        self.log_total = math.log(max(total, 1))
+
+    def overlay_lookup(self, fragment):
+        occurences = self.freq.get(fragment, None)
+        if occurences == None:
+            return self.base.lookup(fragment)
+        return occurences
+
+    def build_route(self, sentence):
+        length = len(sentence)
+        lookup = self.lookup
+        log_total = self.log_total
+        # route[i]: (log probability of the best path from i to the end, end of the first word)
+        route = [None] * length + [(0.0, 0)]
+        for i in range(length - 1, -1, -1):
+            # single character, always a candidate, even when unknown
+            best = (math.log(lookup(sentence[i]) or 1) - log_total + route[i + 1][0], i + 1)
+            j = i + 1
+            while j < length:
+                occurences = lookup(sentence[i:j + 1])
+                if occurences == None:
+                    break
+                if occurences > 0:
+                    candidate = (math.log(occurences) - log_total + route[j + 1][0], j + 1)
+                    if candidate[0] > best[0]:
+                        best = candidate
+                j += 1
+            route[i] = best
+        return route
+
+    def split_non_chinese(self, characters):
+        for fragment in RE_ALPHANUMERIC.split(characters):
+            if RE_ALPHANUMERIC.match(fragment):
+                yield fragment
+            else:
+                yield from fragment
+
+    def cut_chinese(self, characters):
+        route = self.build_route(characters)
+        i = 0
+        while i < len(characters):
+            end = route[i][1]
+            yield characters[i:end]
+            i = end
+
+    def cut_block(self, block):
+        # only runs of chinese characters go through the DAG, a dictionary word such as A must not split a
+        # latin word. like jieba, alphanumeric runs are kept whole
+        for fragment in RE_CHINESE_RUN.split(block):
+            if not fragment:
+                continue
+            if RE_CHINESE_CHARACTER.match(fragment):
+                yield from self.cut_chinese(fragment)
+            else:
+                yield from self.split_non_chinese(fragment)
+
+    def cut(self, text):
+        for block in RE_BLOCK.split(text):
+            if not block:
+                continue
+            if RE_BLOCK.match(block):
+                yield from self.cut_block(block)
+            else:
+                for fragment in RE_SKIP.split(block):
+                    if RE_SKIP.match(fragment):
+                        yield fragment
+                    else:
+                        yield from fragment
+
+    def tokenize(self, text):
+        return list(self.cut(text))
+
+    def split_blocks(self, text):
+        # cut() segments each of these independently of the others
+        return [block for block in RE_BLOCK.split(text) if block]
@@ -22,5 +22,11 @@ setup(name='pinyin_jyutping',
           'jieba',
           'hanzidentifier'
       ],      
+      entry_points={
+          'console_scripts': [
+              'pinyin-jyutping=pinyin_jyutping.cli:main',
+              'pinyin-jyutping-server=pinyin_jyutping.server:main'
+          ],
+      },
       zip_safe=False,
       include_package_data=True)
\ No newline at end of file
@@ -1,6 +1,7 @@
 
 import pickle
 import unittest
+import unittest.mock
 import pytest
 import pprint
 import logging
@@ -8,6 +9,8 @@ import re
 import sys
 import os
 import pdb
+import tempfile
+import jieba
 
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -19,6 +22,9 @@ import pinyin_jyutping.parser
 import pinyin_jyutping.data
 import pinyin_jyutping.logic
 import pinyin_jyutping.constants
+import pinyin_jyutping.compact
+import pinyin_jyutping.tokenizer
+import pinyin_jyutping.cache
 
 from pinyin_jyutping.syllables import PinyinSyllable
 from pinyin_jyutping.constants import PinyinInitials, PinyinFinals, PinyinTones
@@ -94,6 +100,24 @@ class BuildTests(unittest.TestCase):
         data = self.build_data_from_input(input_data)    
         self.assertEqual(pinyin_jyutping.conversion.convert_pinyin_single_solution(data, '忘拿一些东西了', True, False), 'wang4 na2 yi1xie1 dong1xi5 le5')
 
+    def test_convert_pinyin_batch(self):
+        input_data = [
+            ('忘', 'wang4'),
+            ('拿', 'na2'),
+            ('一些', 'yīxiē'),
+            ('东西', 'dōngxi'),
+            ('了', 'le'),
+            ('不', 'bu4'),
+            ('要', 'yao4'),
+        ]
+        data = self.build_data_from_input(input_data)
+        texts = ['忘拿一些东西了', '不要', '东西', '忘拿一些东西了', 'hello 东西']
+        expected_result = [pinyin_jyutping.conversion.convert_pinyin_single_solution(data, text, True, False) for text in texts]
+        self.assertEqual(pinyin_jyutping.conversion.convert_pinyin_single_solution_batch(data, texts, True, False), expected_result)
+        self.assertEqual(expected_result[1], 'bu2yao4')
+        # the tone change on 不 must not leak into the shared rendering of other sentences
+        self.assertEqual(pinyin_jyutping.conversion.convert_pinyin_single_solution_batch(data, iter(['不要', '不']), False, True), ['bú yào', 'bù'])
+
     def test_get_pinyin_solutions_for_word(self):
         input_data = [
             ('忘拿', 'wang4na2'),
@@ -193,6 +217,78 @@ class BuildTests(unittest.TestCase):
         self.assertEqual(output, expected_result)        
 
 
+    def test_dag_tokenizer(self):
+        input_data = [
+            ('投资', 'tou2 zi1'),
+            ('银行', 'yin2 hang2'),
+            ('个人', 'ge4 ren2'),
+            ('所得税', 'suo3 de2 shui4'),
+            ('没有', 'mei2 you3'),
+            # single letter words in the dictionary don't split latin words
+            ('A', 'a1'),
+        ]
+        data = self.build_data_from_input(input_data)
+        tokenizer = pinyin_jyutping.tokenizer.DagTokenizer(data.pinyin_map)
+
+        self.assertEqual(tokenizer.tokenize('投资银行'), ['投资', '银行'])
+        self.assertEqual(tokenizer.tokenize('个人所得税'), ['个人', '所得税'])
+        # unknown characters and non-chinese text
+        self.assertEqual(tokenizer.tokenize('没有ATM，你 3.5%'), ['没有', 'ATM', '，', '你', ' ', '3.5%'])
+        self.assertEqual(tokenizer.tokenize(''), [])
+        self.assertEqual(tokenizer.tokenize('这是ATM，A'), ['这', '是', 'ATM', '，', 'A'])
+
+        self.assertEqual(pinyin_jyutping.conversion.convert_pinyin_single_solution(data, '投资银行没有', True, False, tokenizer), 'tou2zi1 yin2hang2 mei2you3')
+        self.assertEqual(pinyin_jyutping.conversion.convert_pinyin_single_solution_batch(data, ['投资银行'], True, False, tokenizer), ['tou2zi1 yin2hang2'])
+
+    def test_best_first_product(self):
+        streams = [iter([(-0.1, 'a'), (-1.0, 'b')]), iter([(-0.2, 'x'), (-0.3, 'y'), (-2.0, 'z')])]
+        result = [values for log_probability, values in pinyin_jyutping.conversion.best_first_product(streams)]
+        self.assertEqual(result, [['a', 'x'], ['a', 'y'], ['b', 'x'], ['b', 'y'], ['a', 'z'], ['b', 'z']])
+        # an empty stream means no solutions, no streams means a single empty solution
+        self.assertEqual(list(pinyin_jyutping.conversion.best_first_product([iter([(0.0, 'a')]), iter([])])), [])
+        self.assertEqual(list(pinyin_jyutping.conversion.best_first_product([])), [(0, [])])
+
+    def test_solutions_generator(self):
+        input_data = [
+            ('了', 'le5'),
+            ('了', 'liao3'),
+            ('了', 'liao3'),
+            ('好', 'hao3'),
+            ('好', 'hao4'),
+            ('好', 'hao4'),
+        ]
+        data = self.build_data_from_input(input_data)
+        tokenizer = pinyin_jyutping.tokenizer.DagTokenizer(data.pinyin_map)
+        solutions = pinyin_jyutping.conversion.pinyin_solutions_generator(data, '好了', True, True, None, tokenizer)
+        # hao3 liao3 and hao4 le5 are equally likely, ties go to the earlier word
+        self.assertEqual(list(solutions), ['hao4 liao3', 'hao4 le5', 'hao3 liao3', 'hao3 le5'])
+        solutions = pinyin_jyutping.conversion.pinyin_solutions_generator(data, '好了', True, True, 1, tokenizer)
+        self.assertEqual(list(solutions), ['hao4 liao3'])
+
+    def test_character_combinations(self):
+        input_data = [
+            ('好', 'hao3'),
+            ('好', 'hao4'),
+        ]
+        data = self.build_data_from_input(input_data)
+        # the materialized solutions keep all the combinations, only the generators are capped
+        self.assertEqual(len(pinyin_jyutping.conversion.solutions_array_for_word(data.pinyin_map, '好' * 11)), 2 ** 11)
+        solutions = list(pinyin_jyutping.conversion.word_solutions_generator(data.pinyin_map, '好' * 11))
+        self.assertEqual(len(solutions), pinyin_jyutping.constants.MULTI_SOLUTION_MAX_CHARACTER_COMBINATIONS)
+
+    def test_lru_cache(self):
+        cache = pinyin_jyutping.cache.LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        # b is the least recently used
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1, 'evictions': 1, 'size': 2, 'max_size': 2})
+        cache.clear()
+        self.assertEqual(cache.get('a'), None)
+
     # pickle / data storage tests
     # ===========================
 
@@ -213,6 +309,162 @@ class BuildTests(unittest.TestCase):
         unpickled_data = pickle.loads(pickled_data)
 
 
+    def test_word_map_accumulator(self):
+        ma1, ma2, ma3 = [pinyin_jyutping.parser.parse_pinyin(pinyin) for pinyin in ['ma1', 'ma2', 'ma3']]
+        word_map = {}
+        accumulator = pinyin_jyutping.parser.WordMapAccumulator(word_map)
+        for syllables in [ma1, ma2, ma3, ma3, ma2]:
+            accumulator.add('妈', syllables)
+        # nothing is written until finalize
+        self.assertEqual(word_map, {})
+        accumulator.finalize()
+        # ma3 reached 2 occurences before ma2
+        self.assertEqual([(mapping.syllables, mapping.occurences) for mapping in word_map['妈']], [(ma3, 2), (ma2, 2), (ma1, 1)])
+
+        # existing words are seeded from the map, priority moves a mapping to the top
+        accumulator = pinyin_jyutping.parser.WordMapAccumulator(word_map)
+        accumulator.add('妈', ma1, priority=True)
+        accumulator.finalize()
+        self.assertEqual([(mapping.syllables, mapping.occurences) for mapping in word_map['妈']],
+            [(ma1, pinyin_jyutping.constants.OCCURENCES_MAX), (ma3, 2), (ma2, 2)])
+
+    def test_incremental_build(self):
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tools')))
+        import build_data
+        lines = [
+            '上周 上周 [shang4 zhou1] /last week/\n',
+            '誰 谁 [shei2] /who/also pr. [shui2]/\n',
+            '誰知 谁知 [shei2 zhi1] /who would have thought/unexpectedly/\n',
+            '阿誰 阿谁 [a1 shui2] /who/\n',
+        ]
+        expected_data = pinyin_jyutping.data.Data()
+        pinyin_jyutping.parser.parse_cedict_entries(lines, expected_data)
+
+        parse_count = [0]
+        def additions_generator(lines):
+            parse_count[0] += 1
+            return pinyin_jyutping.parser.cedict_word_additions_generator(lines)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_filepath = os.path.join(temp_dir, 'cedict.txt')
+            with open(source_filepath, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            sources = [('cedict', source_filepath, pinyin_jyutping.parser.parse_cedict_file_generator, additions_generator)]
+            cache_directory = os.path.join(temp_dir, 'cache')
+            data = build_data.build_data(sources, cache_directory)
+            self.assertEqual(pickle.dumps(data.pinyin_map), pickle.dumps(expected_data.pinyin_map))
+            # unchanged source, replayed from the cache
+            data = build_data.build_data(sources, cache_directory)
+            self.assertEqual(parse_count[0], 1)
+            self.assertEqual(pickle.dumps(data.pinyin_map), pickle.dumps(expected_data.pinyin_map))
+            # modified source, parsed again
+            with open(source_filepath, 'a', encoding='utf-8') as f:
+                f.write('不准 不准 [bu4 zhun3] /not to allow/to forbid/to prohibit/\n')
+            data = build_data.build_data(sources, cache_directory)
+            self.assertEqual(parse_count[0], 2)
+            self.assertIn('不准', data.pinyin_map)
+
+    def test_parallel_build(self):
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tools')))
+        import build_data
+        lines = [
+            '上周 上周 [shang4 zhou1] /last week/\n',
+            '誰 谁 [shei2] /who/also pr. [shui2]/\n',
+            '誰知 谁知 [shei2 zhi1] /who would have thought/unexpectedly/\n',
+            '阿誰 阿谁 [a1 shui2] /who/\n',
+            '不准 不准 [bu4 zhun3] /not to allow/to forbid/to prohibit/\n',
+            '誰 谁 [shui2] /who/\n',
+        ]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_filepath = os.path.join(temp_dir, 'cedict.txt')
+            with open(source_filepath, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            source = ('cedict', source_filepath, pinyin_jyutping.parser.parse_cedict_file_generator, pinyin_jyutping.parser.cedict_word_additions_generator)
+            sequential_additions = build_data.parse_source(source_filepath, source[2], source[3], 1)
+            # the output doesn't depend on the number of workers
+            for processes in [2, 3]:
+                parallel_additions = build_data.parse_source(source_filepath, source[2], source[3], processes, shard_size=2)
+                self.assertEqual(repr(parallel_additions), repr(sequential_additions))
+            self.assertEqual(pickle.dumps(build_data.build_data([source], None, 3)), pickle.dumps(build_data.build_data([source], None, 1)))
+
+    def test_compact_data(self):
+        data = pinyin_jyutping.data.Data()
+        lines = [
+            '誰 谁 [shei2] /who/also pr. [shui2]/',
+            '誰知 谁知 [shei2 zhi1] /who would have thought/unexpectedly/',
+            '阿誰 阿谁 [a1 shui2] /who/',
+            '不准 不准 [bu4 zhun3] /not to allow/to forbid/to prohibit/'
+        ]
+        pinyin_jyutping.parser.parse_cedict_entries(lines, data)
+        pinyin_jyutping.parser.process_word('按摩', pinyin_jyutping.parser.parse_jyutping('on3 mo1'), data.jyutping_map)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filepath = os.path.join(temp_dir, 'data.dat')
+            pinyin_jyutping.compact.write_compact_data(data, filepath)
+            compact_data = pinyin_jyutping.compact.load_compact_data(filepath)
+
+            for map_name in ['pinyin_map', 'jyutping_map']:
+                word_map = getattr(data, map_name)
+                compact_word_map = getattr(compact_data, map_name)
+                self.assertEqual(len(compact_word_map), len(word_map))
+                self.assertEqual(sorted(compact_word_map.keys()), sorted(word_map.keys()))
+                for key, entry in word_map.items():
+                    self.assertEqual([(x.syllables, x.occurences) for x in compact_word_map.get(key)],
+                                     [(x.syllables, x.occurences) for x in entry])
+            self.assertNotIn('不是', compact_data.pinyin_map)
+            self.assertEqual(compact_data.pinyin_map.get('不是'), None)
+
+            self.assertEqual(pinyin_jyutping.conversion.convert_pinyin_single_solution(compact_data, '谁知', True, True), 'shei2 zhi1')
+
+            # corrections go to the in-memory overlay
+            pinyin_jyutping.parser.process_word('谁',
+                [PinyinSyllable(PinyinInitials.sh, PinyinFinals.ui, PinyinTones.tone_2)], compact_data.pinyin_map, priority=True)
+            self.assertEqual(pinyin_jyutping.conversion.convert_pinyin_single_solution(compact_data, '谁', True, True), 'shui2')
+            self.assertEqual(compact_data.pinyin_map['谁'][0].occurences, pinyin_jyutping.constants.OCCURENCES_MAX)
+
+    def test_jieba_cache(self):
+        saved_state = (jieba.dt.dictionary, jieba.dt.FREQ, jieba.dt.total, jieba.dt.initialized)
+        verified_key_filepath = None
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                dictionary_filepath = os.path.join(temp_dir, 'dict.txt')
+                cache_filepath = os.path.join(temp_dir, 'dict.txt.cache')
+                verified_key_filepath = pinyin_jyutping.tokenizer.verified_key_filepath(cache_filepath)
+                with open(dictionary_filepath, 'w', encoding='utf-8') as f:
+                    f.write('投资 100 n\n银行 200 n\n投资银行 50 n\n')
+
+                # no cache yet
+                self.assertFalse(pinyin_jyutping.tokenizer.load_jieba_cache(dictionary_filepath, cache_filepath))
+
+                pinyin_jyutping.tokenizer.build_jieba_cache(dictionary_filepath, cache_filepath)
+                # the dictionary's size and modification time match, it isn't hashed again
+                with unittest.mock.patch.object(pinyin_jyutping.tokenizer, 'hash_dictionary', side_effect=AssertionError):
+                    self.assertTrue(pinyin_jyutping.tokenizer.load_jieba_cache(dictionary_filepath, cache_filepath))
+                self.assertTrue(jieba.dt.initialized)
+                self.assertEqual(jieba.dt.total, 350)
+                self.assertEqual(jieba.dt.FREQ['银行'], 200)
+                self.assertEqual(jieba.dt.FREQ['投资银'], 0)
+
+                # touched (installed, checked out): hashed once, the content still matches
+                stat = os.stat(dictionary_filepath)
+                os.utime(dictionary_filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+                self.assertTrue(pinyin_jyutping.tokenizer.load_jieba_cache(dictionary_filepath, cache_filepath))
+                with unittest.mock.patch.object(pinyin_jyutping.tokenizer, 'hash_dictionary', side_effect=AssertionError):
+                    self.assertTrue(pinyin_jyutping.tokenizer.load_jieba_cache(dictionary_filepath, cache_filepath))
+
+                # the dictionary changed, the cache doesn't apply anymore, even at the same size
+                with open(dictionary_filepath, 'w', encoding='utf-8') as f:
+                    f.write('投资 900 n\n银行 200 n\n投资银行 50 n\n')
+                os.utime(dictionary_filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 9))
+                self.assertFalse(pinyin_jyutping.tokenizer.load_jieba_cache(dictionary_filepath, cache_filepath))
+                with open(dictionary_filepath, 'a', encoding='utf-8') as f:
+                    f.write('个人 10 n\n')
+                self.assertFalse(pinyin_jyutping.tokenizer.load_jieba_cache(dictionary_filepath, cache_filepath))
+        finally:
+            jieba.dt.dictionary, jieba.dt.FREQ, jieba.dt.total, jieba.dt.initialized = saved_state
+            if verified_key_filepath != None and os.path.exists(verified_key_filepath):
+                os.remove(verified_key_filepath)
+
     @pytest.mark.skip(reason="still experimenting with pickle")
     def test_save_pickle(self):
         data = pinyin_jyutping.data.Data()
@@ -2,8 +2,10 @@ import unittest
 import pytest
 import sys
 import os
+import io
 import json
 import pprint
+import tempfile
 import requests
 import logging
 
@@ -14,6 +16,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 import pinyin_jyutping
 import pinyin_jyutping.parser
 import pinyin_jyutping.errors
+import pinyin_jyutping.cli
 
 """this file contains final end-to-end conversion tests on real data"""
 class JyutpingConversion(unittest.TestCase):
@@ -46,6 +49,58 @@ class JyutpingConversion(unittest.TestCase):
             self.assertEqual(self.pinyin_jyutping.jyutping(chinese), expected_jyutping)
     
 
+    def test_jyutping_batch(self):
+        texts = ['全身按摩', '我出去攞野食', '全身按摩']
+        self.assertEqual(self.pinyin_jyutping.jyutping_batch(texts), [self.pinyin_jyutping.jyutping(text) for text in texts])
+
+    def test_jyutping_stream(self):
+        lines = ['全身按摩\n', '\n', '我出去攞野食\r\n', '全身按摩']
+        output = list(self.pinyin_jyutping.jyutping_stream(iter(lines), chunk_size=2))
+        self.assertEqual(output, [
+            self.pinyin_jyutping.jyutping('全身按摩') + '\n',
+            '\n',
+            self.pinyin_jyutping.jyutping('我出去攞野食') + '\r\n',
+            self.pinyin_jyutping.jyutping('全身按摩'),
+        ])
+
+    def test_cli(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        try:
+            input_filepath = os.path.join(temporary_directory.name, 'input.txt')
+            output_filepath = os.path.join(temporary_directory.name, 'output.txt')
+            with open(input_filepath, 'w', encoding='utf-8') as f:
+                f.write('全身按摩\n我出去攞野食\n')
+            pinyin_jyutping.cli.main(['jyutping', '--tone-numbers', '--input', input_filepath, '--output', output_filepath])
+            with open(output_filepath, 'r', encoding='utf-8') as f:
+                output = f.read()
+        finally:
+            temporary_directory.cleanup()
+        expected = ''.join([self.pinyin_jyutping.jyutping(text, tone_numbers=True) + '\n' for text in ['全身按摩', '我出去攞野食']])
+        self.assertEqual(output, expected)
+        # stdin and stdout, which are still usable afterwards
+        saved_streams = (sys.stdin, sys.stdout)
+        sys.stdin = io.TextIOWrapper(io.BytesIO('全身按摩\n我出去攞野食\n'.encode('utf-8')))
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        try:
+            pinyin_jyutping.cli.main(['jyutping', '--tone-numbers'])
+            self.assertFalse(sys.stdout.buffer.closed)
+            self.assertFalse(sys.stdin.buffer.closed)
+            output = sys.stdout.buffer.getvalue().decode('utf-8')
+        finally:
+            sys.stdin, sys.stdout = saved_streams
+        self.assertEqual(output, expected)
+
+    def test_lazy_loading(self):
+        lazy_instance = pinyin_jyutping.PinyinJyutping(lazy=True)
+        self.assertEqual(lazy_instance.timings, {})
+        self.assertEqual(lazy_instance.jyutping('全身按摩'), self.pinyin_jyutping.jyutping('全身按摩'))
+        # a jyutping-only user never loads the pinyin map
+        self.assertTrue(lazy_instance.data.is_loaded('jyutping_map'))
+        self.assertFalse(lazy_instance.data.is_loaded('pinyin_map'))
+        self.assertIn('load_jyutping_map', lazy_instance.timings)
+        self.assertIn('initialize_jieba', lazy_instance.timings)
+        self.assertNotIn('load_pinyin_map', lazy_instance.timings)
+
     def test_user_corrections(self):
         # apply corrections
         pinyin_jyutping_instance_1 = pinyin_jyutping.PinyinJyutping()
@@ -60,6 +115,51 @@ class JyutpingConversion(unittest.TestCase):
         self.assertEqual(pinyin_jyutping_instance_1.jyutping('全身按摩'), 'cyùnsān ōnmō')
 
 
+    def test_import_corrections(self):
+        instance = pinyin_jyutping.PinyinJyutping()
+        report = instance.import_jyutping_corrections([
+            {'chinese': '按摩', 'jyutping': 'on1mo1'},
+            {'chinese': '按摩', 'jyutping': 'on1'},
+            {'chinese': '按摩'},
+        ])
+        self.assertEqual(report['accepted'], 1)
+        self.assertEqual([rejected['index'] for rejected in report['rejected']], [1, 2])
+        self.assertEqual(report['rejected'][1]['entry'], {'chinese': '按摩'})
+        self.assertEqual(instance.jyutping('全身按摩'), 'cyùnsān ōnmō')
+        # same result as applying the corrections one at a time, several of them for the same words
+        corrections = [
+            {'chinese': '按摩', 'jyutping': 'on3mo1'},
+            {'chinese': '全身按摩', 'jyutping': 'cyun4san1on1mo1'},
+            {'chinese': '按摩', 'jyutping': 'on3mo1'},
+            {'chinese': '按摩', 'jyutping': 'on1mo4'},
+            {'chinese': '全身', 'jyutping': 'cyun4 san1'},
+        ]
+        bulk_instance = pinyin_jyutping.PinyinJyutping()
+        bulk_instance.import_jyutping_corrections(corrections)
+        sequential_instance = pinyin_jyutping.PinyinJyutping()
+        for correction in corrections:
+            syllables = pinyin_jyutping.parser.parse_jyutping(correction['jyutping'])
+            pinyin_jyutping.parser.process_word(correction['chinese'], syllables, sequential_instance.data.jyutping_map, priority=True)
+        for word in ['全身按摩', '按摩', '全身', '按', '摩', '全', '身']:
+            self.assertEqual(repr(bulk_instance.data.jyutping_map[word]), repr(sequential_instance.data.jyutping_map[word]), word)
+        # files, the format is taken from the extension
+        temporary_directory = tempfile.TemporaryDirectory()
+        try:
+            csv_filepath = os.path.join(temporary_directory.name, 'corrections.csv')
+            with open(csv_filepath, 'w', encoding='utf-8') as f:
+                f.write('chinese,jyutping\n你好,nei5 hou3\n')
+            json_filepath = os.path.join(temporary_directory.name, 'corrections.json')
+            with open(json_filepath, 'w', encoding='utf-8') as f:
+                json.dump([{'chinese': '全身', 'jyutping': 'cyun4 san1'}], f)
+            csv_report = instance.import_jyutping_corrections(csv_filepath)
+            json_report = instance.import_jyutping_corrections(json_filepath)
+        finally:
+            temporary_directory.cleanup()
+        self.assertEqual(csv_report, {'accepted': 1, 'rejected': []})
+        self.assertEqual(json_report, {'accepted': 1, 'rejected': []})
+        self.assertEqual(instance.jyutping('你好', tone_numbers=True), 'nei5hou3')
+        self.assertEqual(instance.jyutping('全身按摩', tone_numbers=True), 'cyun4san1 on1mo1')
+
     def test_load_anki_deck(self):
         # pytest tests/test_jyutping_conversion.py -k test_load_anki_deck -s -rPP  --log-cli-level=ERROR
         json_file_path = os.path.join(os.path.dirname(__file__), '..', 'source_data', 'cantonese_jyutping_anki_deck.json')
@@ -75,3 +75,19 @@ class JyutpingParsingTests(unittest.TestCase):
                 # self.assertTrue(False)
 
         self.assertGreater(matched_entries, 105816)
+
+    def test_parse_jyutping_batch(self):
+        results = pinyin_jyutping.parser.parse_jyutping_batch(['ngo5 hai6', 'nei5 hou2 zz', 'ngo5 hai6'])
+        self.assertEqual(results[0]['tone_numbers'], 'ngo5 hai6')
+        self.assertEqual(results[0]['tone_marks'], 'ngǒ hai')
+        self.assertEqual(results[1]['error'], {'start': 10, 'end': 12, 'text': 'zz'})
+        self.assertEqual(results[2], results[0])
+        # duplicates are separate copies
+        results = pinyin_jyutping.parser.parse_jyutping_batch(['ngo5 hai6', 'zz', 'ngo5 hai6', 'zz'])
+        self.assertIsNot(results[2], results[0])
+        self.assertIsNot(results[2]['syllables'], results[0]['syllables'])
+        self.assertIsNot(results[3]['error'], results[1]['error'])
+        results[0]['syllables'].pop()
+        results[1]['error']['start'] = 1
+        self.assertEqual(len(results[2]['syllables']), 2)
+        self.assertEqual(results[3]['error'], {'start': 0, 'end': 2, 'text': 'zz'})
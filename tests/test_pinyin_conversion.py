@@ -4,6 +4,13 @@ import sys
 import os
 import json
 import pprint
+import asyncio
+import multiprocessing
+import threading
+import urllib.request
+import concurrent.futures
+import operator
+import functools
 import requests
 import logging
 
@@ -14,6 +21,14 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 import pinyin_jyutping
 import pinyin_jyutping.parser
 import pinyin_jyutping.errors
+import pinyin_jyutping.instrumentation
+import pinyin_jyutping.conversion
+import pinyin_jyutping.server
+import jieba
+
+def worker_compact_data():
+    # runs in a pool worker
+    return pinyin_jyutping.parallel.worker_instance.compact_data
 
 """this file contains final end-to-end conversion tests on real data"""
 class PinyinConversion(unittest.TestCase):
@@ -92,6 +107,14 @@ class PinyinConversion(unittest.TestCase):
             )
 
 
+    def test_character_fast_path(self):
+        # single characters and non-chinese blocks don't go through jieba, the words must be the same
+        for text in ['', '忘', 'a', ' ', 'hello world, 3.5% off!', 'C++ and AT&T', 'a-b_c.d', '这是ATM', 'T恤 100%', 'line\r\nbreak', '，。　']:
+            self.assertEqual(pinyin_jyutping.conversion.tokenize(text), list(jieba.cut(text)))
+        for character in ['忘', '了', 'a', '，']:
+            self.assertEqual(self.pinyin_jyutping.pinyin(character), self.pinyin_jyutping.pinyin_all_solutions(character)['solutions'][0][0])
+        self.assertEqual(self.pinyin_jyutping.pinyin('hello world'), 'hello   world')
+
     # @pytest.mark.skip(reason="too many alternatives")
     def test_pinyin_sentences(self):
         self.assertEqual(self.pinyin_jyutping.pinyin('忘拿一些东西了'), 'wàng ná yīxiē dōngxī le')
@@ -112,6 +135,224 @@ class PinyinConversion(unittest.TestCase):
         self.assertEqual(self.pinyin_jyutping.pinyin('一个'), 'yígè')
         self.assertEqual(self.pinyin_jyutping.pinyin('逛一逛'), 'guàngyíguàng')
 
+    def test_tone_sandhi_modes(self):
+        ToneSandhi = pinyin_jyutping.constants.ToneSandhi
+        # default: only 不 and 一 before a fourth tone
+        self.assertEqual(self.pinyin_jyutping.pinyin('不要', tone_numbers=True), 'bu2yao4')
+        self.assertEqual(self.pinyin_jyutping.pinyin('我很好', tone_numbers=True, spaces=True), 'wo3 hen3 hao3')
+        all_modes = pinyin_jyutping.PinyinJyutping(tone_sandhi=ToneSandhi.bu_yi | ToneSandhi.yi | ToneSandhi.third_tone)
+        self.assertEqual(all_modes.pinyin('你好', tone_numbers=True, spaces=True), 'ni2 hao3')
+        self.assertEqual(all_modes.pinyin('我很好', tone_numbers=True, spaces=True), 'wo2 hen2 hao3')
+        self.assertEqual(all_modes.pinyin('一天', tone_numbers=True, spaces=True), 'yi4 tian1')
+        self.assertEqual(all_modes.pinyin('不要', tone_numbers=True, spaces=True), 'bu2 yao4')
+        texts = ['我很好', '一天', '不要', '你好吗']
+        self.assertEqual(all_modes.pinyin_batch(texts), [all_modes.pinyin(text) for text in texts])
+        # the dictionary is left untouched
+        self.assertEqual(self.pinyin_jyutping.pinyin('你好', tone_numbers=True, spaces=True), 'ni3 hao3')
+        no_sandhi = pinyin_jyutping.PinyinJyutping(tone_sandhi=ToneSandhi(0))
+        self.assertEqual(no_sandhi.pinyin('不要', tone_numbers=True, spaces=True), 'bu4 yao4')
+
+    def test_pinyin_batch(self):
+        texts = ['穿不上', '没有', '忘拿一些东西了', '这是ATM', '没有']
+        expected_output = [self.pinyin_jyutping.pinyin(text, tone_numbers=True) for text in texts]
+        self.assertEqual(self.pinyin_jyutping.pinyin_batch(texts, tone_numbers=True), expected_output)
+        self.assertEqual(self.pinyin_jyutping.pinyin_batch(['不够亮', '不成熟']), ['búgòu liàng', 'bù chéngshú'])
+        # blocks shared between sentences, with and without a tone change
+        texts = ['没有，一个', '一个，没有。', '没有 ATM', '投资银行不见了', '投资银行，一些', 'a']
+        for instance in [self.pinyin_jyutping, pinyin_jyutping.PinyinJyutping(segmenter=pinyin_jyutping.constants.Segmenter.dag)]:
+            self.assertEqual(instance.pinyin_batch(texts, spaces=True), [instance.pinyin(text, spaces=True) for text in texts])
+            self.assertEqual(instance.jyutping_batch(texts), [instance.jyutping(text) for text in texts])
+
+    def test_compact_data(self):
+        compact_instance = pinyin_jyutping.PinyinJyutping(compact_data=True)
+        for text in ['穿不上', '没有', '忘拿一些东西了', '这是ATM', '請問，你叫什麼名字？']:
+            self.assertEqual(compact_instance.pinyin(text), self.pinyin_jyutping.pinyin(text))
+            self.assertEqual(compact_instance.pinyin_all_solutions(text), self.pinyin_jyutping.pinyin_all_solutions(text))
+
+    def test_dag_segmenter(self):
+        dag_instance = pinyin_jyutping.PinyinJyutping(segmenter=pinyin_jyutping.constants.Segmenter.dag)
+        self.assertEqual(dag_instance.pinyin('没有'), 'méiyǒu')
+        self.assertEqual(dag_instance.pinyin('投资银行', spaces=True), 'tóu zī yín háng')
+        self.assertEqual(dag_instance.pinyin('这是ATM', tone_numbers=True, spaces=True), 'zhe4 shi4 ATM')
+
+    def test_result_cache(self):
+        instance = pinyin_jyutping.PinyinJyutping(cache_size=2)
+        self.assertEqual(instance.pinyin('没有'), self.pinyin_jyutping.pinyin('没有'))
+        self.assertEqual(instance.pinyin('没有'), self.pinyin_jyutping.pinyin('没有'))
+        # different options, different entry
+        instance.pinyin('没有', tone_numbers=True)
+        instance.pinyin('忘拿一些东西了')
+        self.assertEqual(instance.cache_stats(), {'hits': 1, 'misses': 3, 'evictions': 1, 'size': 2, 'max_size': 2})
+        # corrections invalidate the cache
+        instance.load_pinyin_corrections([{'chinese': '没有', 'pinyin': 'mei4 you3'}])
+        self.assertEqual(instance.cache_stats()['size'], 0)
+        self.assertEqual(instance.pinyin('没有'), 'mèiyǒu')
+        # disabled by default
+        self.assertEqual(self.pinyin_jyutping.cache_stats(), None)
+
+    def test_conversion_stats(self):
+        recorded_stages = []
+        stats = pinyin_jyutping.instrumentation.ConversionStats(callback=lambda stage, duration: recorded_stages.append(stage))
+        instance = pinyin_jyutping.PinyinJyutping(stats=stats)
+        text = '对不起，这个字我会读，不会写。'
+        word_list = instance.pinyin_all_solutions(text)['word_list']
+        stats.reset()
+        self.assertEqual(instance.pinyin(text), self.pinyin_jyutping.pinyin(text))
+        result = stats.as_dict()
+        self.assertEqual(result['counters']['conversions'], 1)
+        self.assertEqual(result['counters']['words_looked_up'], len(word_list))
+        # punctuation goes through as it is
+        self.assertEqual(result['counters']['pass_through_syllables'], 3)
+        self.assertGreaterEqual(result['counters']['solutions_enumerated'], len(word_list))
+        for stage in pinyin_jyutping.instrumentation.STAGES:
+            self.assertGreater(result['stage_times'][stage], 0)
+            self.assertIn(stage, recorded_stages)
+        # the batch API counts the same way
+        stats.reset()
+        instance.pinyin_batch([text])
+        self.assertEqual(stats.as_dict()['counters'], result['counters'])
+        # the solutions generator counts each solution
+        stats.reset()
+        solutions = list(instance.pinyin_solutions_generator('了了', limit=3))
+        self.assertEqual(stats.as_dict()['counters']['solutions_enumerated'], len(solutions))
+        # disabled by default
+        self.assertEqual(self.pinyin_jyutping.stats, None)
+
+    def test_pinyin_parallel(self):
+        instance = pinyin_jyutping.PinyinJyutping()
+        instance.load_pinyin_corrections([{'chinese': '没有', 'pinyin': 'mei4 you3'}])
+        texts = ['没有', '忘拿一些东西了', '对不起，这个字我会读，不会写。', ''] * 50
+        expected = instance.pinyin_batch(texts)
+        self.assertEqual(instance.pinyin_parallel(texts, processes=2, chunk_size=7), expected)
+        # spawned workers open the compact data file and replay the corrections
+        result = pinyin_jyutping.parallel.convert_parallel(instance, 'pinyin_map', texts, False, False, 2, 50, 'spawn')
+        self.assertEqual(result, expected)
+        # even when the parent loaded the pickles
+        self.assertFalse(instance.compact_data)
+        pool = pinyin_jyutping.parallel.create_pool(instance, 'pinyin_map', 1, 'spawn')
+        try:
+            self.assertTrue(pool.apply(worker_compact_data))
+            pool.close()
+        finally:
+            pool.join()
+
+    @pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs the fork start method')
+    def test_pinyin_parallel_respawned_worker(self):
+        instance = pinyin_jyutping.PinyinJyutping()
+        pool = pinyin_jyutping.parallel.create_pool(instance, 'pinyin_map', 1, 'fork')
+        try:
+            # the pool replaces a worker which exits, the new one must have the instance too
+            worker = pool._pool[0]
+            pool.apply_async(os._exit, (0,))
+            worker.join()
+            arguments = ('pinyin_map', ['没有'], False, False)
+            self.assertEqual(pool.apply_async(pinyin_jyutping.parallel.convert_chunk, (arguments,)).get(timeout=30), ['méiyǒu'])
+        finally:
+            # the task which exited never completes, don't wait for it
+            pool.terminate()
+            pool.join()
+
+    def test_apinyin(self):
+        stats = pinyin_jyutping.instrumentation.ConversionStats()
+        instance = pinyin_jyutping.PinyinJyutping(stats=stats)
+        texts = ['没有', '忘拿一些东西了', '对不起，这个字我会读，不会写。'] * 10
+        async def convert_all():
+            return await asyncio.gather(*[instance.apinyin(text) for text in texts])
+        self.assertEqual(asyncio.run(convert_all()), [self.pinyin_jyutping.pinyin(text) for text in texts])
+        # identical requests in flight at the same time are converted once
+        self.assertEqual(stats.as_dict()['counters']['conversions'], 3)
+        self.assertEqual(asyncio.run(instance.ajyutping('你好', tone_numbers=True)), 'nei5hou2')
+        # overlays share the converter of the instance, and convert with their own corrections
+        overlay = instance.create_overlay()
+        overlay.load_pinyin_corrections([{'chinese': '一些', 'pinyin': 'yi4xie1'}])
+        self.assertIs(overlay.get_async_converter(), instance.get_async_converter())
+        async def convert_with_overlay():
+            return await asyncio.gather(instance.apinyin('一些'), overlay.apinyin('一些'), overlay.apinyin('没有'))
+        self.assertEqual(asyncio.run(convert_with_overlay()), ['yīxiē', 'yìxiē', 'méiyǒu'])
+        # process pool, the workers replay the corrections, the ones of the overlay come with its conversions
+        instance.load_pinyin_corrections([{'chinese': '没有', 'pinyin': 'mei4 you3'}])
+        instance.configure_async(pinyin_jyutping.constants.Executor.process, max_workers=1, max_pending=2)
+        try:
+            self.assertEqual(asyncio.run(convert_all()), [instance.pinyin(text) for text in texts])
+            self.assertEqual(asyncio.run(convert_with_overlay()), ['yīxiē', 'yìxiē', 'mèiyǒu'])
+            # corrections loaded into the overlay afterwards too
+            overlay.load_pinyin_corrections([{'chinese': '东西', 'pinyin': 'dong4xi1'}])
+            self.assertEqual(asyncio.run(overlay.apinyin('东西')), 'dòngxī')
+            self.assertEqual(asyncio.run(instance.apinyin('东西')), instance.pinyin('东西'))
+        finally:
+            instance.shutdown_async()
+
+    def test_server(self):
+        server = pinyin_jyutping.server.ConversionServer(('127.0.0.1', 0), self.pinyin_jyutping, max_delay=0.05)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        def post(path, request):
+            http_request = urllib.request.Request(url + path, data=json.dumps(request).encode('utf-8'))
+            return json.loads(urllib.request.urlopen(http_request).read())['result']
+        try:
+            texts = ['没有', '忘拿一些东西了', '对不起，这个字我会读，不会写。'] * 4
+            with concurrent.futures.ThreadPoolExecutor(len(texts)) as executor:
+                results = list(executor.map(lambda text: post('/pinyin', {'text': text, 'tone_numbers': True}), texts))
+            self.assertEqual(results, [self.pinyin_jyutping.pinyin(text, tone_numbers=True) for text in texts])
+            self.assertEqual(post('/pinyin_all_solutions', {'text': '了'}), self.pinyin_jyutping.pinyin_all_solutions('了'))
+            self.assertEqual(post('/parse_pinyin', {'texts': ['ni3hao3']})[0]['syllables'], ['ni3', 'hao3'])
+            stats = json.loads(urllib.request.urlopen(url + '/stats').read())
+            self.assertEqual(stats['latency']['/pinyin']['count'], len(texts))
+            # concurrent requests got converted together
+            self.assertEqual(stats['batching']['texts'], len(texts))
+            self.assertLess(stats['batching']['batches'], len(texts))
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                post('/pinyin', {'txt': '没有'})
+            self.assertEqual(context.exception.code, 400)
+            # invalid requests are rejected on their own, without failing the ones batched with them
+            requests = [{'text': text, 'tone_numbers': True} for text in texts] + [{'text': 1}, {'text': '没有', 'spaces': 'yes'}]
+            def post_status(request):
+                try:
+                    post('/pinyin', request)
+                except urllib.error.HTTPError as e:
+                    return e.code
+                return 200
+            with concurrent.futures.ThreadPoolExecutor(len(requests)) as executor:
+                statuses = list(executor.map(post_status, requests))
+            self.assertEqual(statuses, [200] * len(texts) + [400, 400])
+            # errors are timed too
+            stats = json.loads(urllib.request.urlopen(url + '/stats').read())
+            self.assertEqual(stats['latency']['/pinyin']['count'], 2 * len(texts) + 3)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_server_batch_failure(self):
+        # a failing batch is converted again text by text, only the failing text's request gets the exception
+        class FailingInstance():
+            def pinyin_batch(self, texts, tone_numbers, spaces):
+                if '坏' in texts:
+                    raise RuntimeError('failed')
+                return [text + '!' for text in texts]
+        batcher = pinyin_jyutping.server.ConversionBatcher(FailingInstance())
+        try:
+            futures = [concurrent.futures.Future() for i in range(3)]
+            batcher.convert_group('pinyin_map', False, False, list(zip(['好', '坏', '没有'], futures)))
+            self.assertEqual(futures[0].result(), '好!')
+            self.assertRaises(RuntimeError, futures[1].result)
+            self.assertEqual(futures[2].result(), '没有!')
+        finally:
+            batcher.stop()
+
+    def test_pinyin_solutions_generator(self):
+        # the first solution is the regular conversion, the rest come lazily
+        for text in ['忘拿一些东西了', '往后面坐', '对不起，这个字我会读，不会写。', '']:
+            solutions = list(self.pinyin_jyutping.pinyin_solutions_generator(text, limit=10))
+            self.assertEqual(solutions[0], self.pinyin_jyutping.pinyin(text))
+            self.assertEqual(len(solutions), len(set(solutions)))
+        # one solution per combination of the word solutions
+        all_solutions = self.pinyin_jyutping.pinyin_all_solutions('往后面坐')
+        expected_count = functools.reduce(operator.mul, [len(solutions) for solutions in all_solutions['solutions']])
+        self.assertEqual(len(list(self.pinyin_jyutping.pinyin_solutions_generator('往后面坐'))), expected_count)
+        # a long sentence has an astronomical number of combinations, only enumerate a few
+        solutions = self.pinyin_jyutping.pinyin_solutions_generator('了' * 100, tone_numbers=True, spaces=True, limit=3)
+        self.assertEqual(len(list(solutions)), 3)
+
     def test_pinyin_conversion_data_1(self):
         # large test 
         json_file_path = os.path.join(os.path.dirname(__file__), '..', 'source_data', 'pinyin_conversion_test_data_1.json')
@@ -159,6 +400,48 @@ class PinyinConversion(unittest.TestCase):
         self.assertEqual(pinyin_jyutping_instance_1.pinyin('忘拿一些东西了'), 'wàng ná yīxiē dōngxi le')
 
 
+    def test_correction_overlay(self):
+        base = pinyin_jyutping.PinyinJyutping()
+        overlay = base.create_overlay()
+        overlay.load_pinyin_corrections([{'chinese': '没有', 'pinyin': 'mei4 you3'}])
+        self.assertEqual(overlay.pinyin('没有'), 'mèiyǒu')
+        self.assertEqual(overlay.pinyin('忘拿一些东西了'), base.pinyin('忘拿一些东西了'))
+        # the base dictionary and the other overlays are untouched
+        self.assertEqual(base.pinyin('没有'), 'méiyǒu')
+        self.assertEqual(base.create_overlay().pinyin('没有'), 'méiyǒu')
+        # stacked
+        stacked = overlay.create_overlay()
+        stacked.load_pinyin_corrections([{'chinese': '一些', 'pinyin': 'yi4xie1'}])
+        self.assertEqual(stacked.pinyin('没有一些'), 'mèiyǒu yìxiē')
+        self.assertEqual(overlay.pinyin('一些'), 'yīxiē')
+        # corrections of the base show through
+        base.load_jyutping_corrections([{'chinese': '你好', 'jyutping': 'nei5 hou3'}])
+        self.assertEqual(stacked.jyutping('你好', tone_numbers=True), 'nei5hou3')
+        # the dictionary segmenter weighs the words of the overlay on top of the base segmenter
+        dag_instance = pinyin_jyutping.PinyinJyutping(segmenter=pinyin_jyutping.constants.Segmenter.dag)
+        dag_overlay = dag_instance.create_overlay()
+        dag_overlay.load_pinyin_corrections([{'chinese': '没有', 'pinyin': 'mei4 you3'}])
+        self.assertEqual(dag_overlay.pinyin('投资银行没有', spaces=True), 'tóu zī yín háng mèi yǒu')
+        self.assertEqual(dag_instance.pinyin('没有'), 'méiyǒu')
+        # corrections loaded into the base afterwards reach the overlay's segmenter
+        self.assertEqual(dag_overlay.get_tokenizer('pinyin_map').lookup('行没有人'), None)
+        dag_instance.load_pinyin_corrections([{'chinese': '行没有人', 'pinyin': 'hang2 mei2 you3 ren2'}])
+        self.assertGreater(dag_overlay.get_tokenizer('pinyin_map').lookup('行没有人'), 0)
+        self.assertIs(dag_overlay.get_tokenizer('pinyin_map').base, dag_instance.get_tokenizer('pinyin_map'))
+        # and its result cache
+        cached_base = pinyin_jyutping.PinyinJyutping(cache_size=10)
+        cached_overlay = cached_base.create_overlay()
+        cached_stacked = cached_overlay.create_overlay()
+        self.assertEqual(cached_overlay.pinyin('你好', tone_numbers=True), 'ni3hao3')
+        self.assertEqual(cached_stacked.pinyin('你好', tone_numbers=True), 'ni3hao3')
+        cached_base.load_pinyin_corrections([{'chinese': '你好', 'pinyin': 'ni2 hao3'}])
+        self.assertEqual(cached_overlay.pinyin('你好', tone_numbers=True), 'ni2hao3')
+        self.assertEqual(cached_stacked.pinyin('你好', tone_numbers=True), 'ni2hao3')
+        # spawned worker processes replay the corrections of the base, then the overlay's
+        cached_overlay.load_pinyin_corrections([{'chinese': '没有', 'pinyin': 'mei4 you3'}])
+        self.assertEqual([map_name for map_name, corrections in cached_stacked.replayed_corrections()], ['pinyin_map', 'pinyin_map'])
+        self.assertEqual(cached_stacked.replayed_corrections()[1][1], [{'chinese': '没有', 'pinyin': 'mei4 you3'}])
+
     def get_baserow_records(self):
         more_results = True
 
@@ -15,6 +15,7 @@ import pinyin_jyutping.data
 import pinyin_jyutping.logic
 import pinyin_jyutping.constants
 import pinyin_jyutping.cache
+import pinyin_jyutping.errors
 
 from pinyin_jyutping.syllables import PinyinSyllable
 from pinyin_jyutping.constants import PinyinInitials, PinyinFinals, PinyinTones
@@ -127,3 +128,32 @@ class PinyinParsingTests(unittest.TestCase):
         self.assertEqual(output, expected_output)
 
 
+
+    def test_parse_pinyin_separators(self):
+        expected_output = [
+            PinyinSyllable(PinyinInitials.n, PinyinFinals.i, PinyinTones.tone_3),
+            PinyinSyllable(PinyinInitials.h, PinyinFinals.ao, PinyinTones.tone_3),
+        ]
+        for text in ['ni3hao3', 'ni3, hao3', 'Nǐ hǎo！', 'nǐ / hǎo。', '“nǐ hǎo”', '？nǐ hǎo']:
+            self.assertEqual(pinyin_jyutping.parser.parse_pinyin(text), expected_output, text)
+        self.assertEqual(pinyin_jyutping.parser.parse_pinyin(' ... '), [])
+        with self.assertRaises(pinyin_jyutping.errors.PinyinSyllableNotFound):
+            pinyin_jyutping.parser.parse_pinyin('ni3 xyz')
+
+    def test_parse_pinyin_batch(self):
+        instance = pinyin_jyutping.PinyinJyutping(lazy=True)
+        results = instance.parse_pinyin_batch(['Nǐ hǎo！', 'ni3, xyz4 hao3', 'ni3hao3', ''])
+        self.assertEqual(results[0], {
+            'syllables': [
+                PinyinSyllable(PinyinInitials.n, PinyinFinals.i, PinyinTones.tone_3),
+                PinyinSyllable(PinyinInitials.h, PinyinFinals.ao, PinyinTones.tone_3)],
+            'tone_numbers': 'ni3 hao3',
+            'tone_marks': 'nǐ hǎo',
+            'error': None})
+        # offsets are in the original text
+        self.assertEqual(results[1], {'syllables': None, 'tone_numbers': None, 'tone_marks': None,
+            'error': {'start': 5, 'end': 9, 'text': 'xyz4'}})
+        self.assertEqual(results[2]['tone_marks'], 'nǐ hǎo')
+        self.assertEqual(results[3]['syllables'], [])
+        # parsing doesn't need the dictionary
+        self.assertFalse(instance.data.is_loaded('pinyin_map'))
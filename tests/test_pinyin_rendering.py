@@ -1,6 +1,8 @@
 import unittest
 import pytest
 import pprint
+import pickle
+import copyreg
 import logging
 import sys
 import os
@@ -14,6 +16,8 @@ import pinyin_jyutping.parser
 import pinyin_jyutping.data
 import pinyin_jyutping.logic
 import pinyin_jyutping.constants
+import pinyin_jyutping.cache
+import pinyin_jyutping.syllables
 
 from pinyin_jyutping.syllables import PinyinSyllable
 from pinyin_jyutping.constants import PinyinInitials, PinyinFinals, PinyinTones
@@ -87,4 +91,42 @@ class PinyinRenderingTests(unittest.TestCase):
             PinyinFinals.er, 
             PinyinTones.tone_neutral,
             'r'),
-            'r5')                
\ No newline at end of file
+            'r5')                
+    def test_render_tables(self):
+        # every syllable is rendered at import time, make sure the memoized renderings are the computed ones
+        for syllable in pinyin_jyutping.cache.PinyinSyllablesMap.values():
+            args = (syllable.initial, syllable.final, syllable.tone)
+            self.assertEqual(syllable.render_tone_mark(), pinyin_jyutping.logic.render_tone_mark.__wrapped__(*args))
+            self.assertEqual(syllable.render_tone_number(), pinyin_jyutping.logic.render_tone_number.__wrapped__(*args))
+        for syllable in pinyin_jyutping.cache.JyutpingSyllablesMap.values():
+            args = (syllable.initial, syllable.final, syllable.tone)
+            self.assertEqual(syllable.render_tone_mark(), pinyin_jyutping.logic.jyutping_render_tone_mark.__wrapped__(*args))
+            self.assertEqual(syllable.render_tone_number(), pinyin_jyutping.logic.jyutping_render_tone_number.__wrapped__(*args))
+
+    def test_syllable_interning(self):
+        syllable = pinyin_jyutping.syllables.build_pinyin_syllable(PinyinInitials.b, PinyinFinals.u, PinyinTones.tone_4)
+        self.assertIs(syllable, pinyin_jyutping.syllables.build_pinyin_syllable(PinyinInitials.b, PinyinFinals.u, PinyinTones.tone_4))
+        self.assertEqual(syllable, PinyinSyllable(PinyinInitials.b, PinyinFinals.u, PinyinTones.tone_4))
+        self.assertEqual(hash(syllable), hash(PinyinSyllable(PinyinInitials.b, PinyinFinals.u, PinyinTones.tone_4)))
+        # immutable, tone changes return the sibling syllable
+        with self.assertRaises(AttributeError):
+            syllable.tone = PinyinTones.tone_2
+        tone_2 = syllable.with_tone(PinyinTones.tone_2)
+        self.assertIs(tone_2, pinyin_jyutping.syllables.build_pinyin_syllable(PinyinInitials.b, PinyinFinals.u, PinyinTones.tone_2))
+        self.assertEqual(tone_2.render_tone_mark(), 'bú')
+        self.assertNotEqual(tone_2.syllable_id, syllable.syllable_id)
+        # unpickling returns the interned instance
+        self.assertIs(pickle.loads(pickle.dumps(syllable)), syllable)
+        # pickles written before syllables were interned carry a state dict, restored on a new object
+        legacy_reduce = lambda self: (copyreg.__newobj__, (type(self),), {'initial': self.initial, 'final': self.final, 'tone': self.tone})
+        word_map = {'不': [pinyin_jyutping.data.Mapping([syllable])], 'A': [pinyin_jyutping.data.Mapping([pinyin_jyutping.syllables.PassThroughSyllable('A')])]}
+        PinyinSyllable.__reduce__ = legacy_reduce
+        try:
+            legacy_pickle = pickle.dumps(word_map)
+        finally:
+            del PinyinSyllable.__reduce__
+        restored_map = pickle.loads(legacy_pickle)
+        self.assertIsNot(restored_map['不'][0].syllables[0], syllable)
+        self.assertTrue(pinyin_jyutping.syllables.intern_syllables(restored_map))
+        self.assertIs(restored_map['不'][0].syllables[0], syllable)
+        self.assertFalse(pinyin_jyutping.syllables.intern_syllables(restored_map))
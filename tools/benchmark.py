@@ -0,0 +1,270 @@
+import os
+import sys
+import json
+import time
+import platform
+import datetime
+import subprocess
+import argparse
+import logging
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+logging.basicConfig(level=logging.WARN)
+
+logger = logging.getLogger(__file__)
+
+import pinyin_jyutping
+import pinyin_jyutping.conversion
+import pinyin_jyutping.logic
+import pinyin_jyutping.parser
+import pinyin_jyutping.data
+import pinyin_jyutping.errors
+
+# benchmark suite
+# ===============
+#
+# measures each phase over the bundled corpora, and writes the results as json, so that runs on different
+# commits can be compared (see --compare):
+#  - cold_load: construction of a PinyinJyutping instance in a fresh process, with the time of each phase
+#  - pinyin_latency / jyutping_latency: per-sentence conversion time, p50 / p99
+#  - pinyin_all_solutions: per-sentence cost of generating all the solutions
+#  - parse_pinyin: romanization parsing throughput
+#  - process_word: dictionary ingestion rate
+#  - debug_logging: per-call cost of building the debug logging payloads, see set_debug_logging
+# all durations are in microseconds, except for cold_load, in seconds.
+
+ROOT_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+PINYIN_CORPUS = os.path.join(ROOT_DIRECTORY, 'source_data', 'pinyin_conversion_test_data_1.json')
+JYUTPING_CORPUS = os.path.join(ROOT_DIRECTORY, 'source_data', 'cantonese_jyutping_anki_deck.json')
+
+PHASES = ['cold_load', 'pinyin_latency', 'jyutping_latency', 'pinyin_all_solutions', 'parse_pinyin', 'process_word', 'debug_logging']
+
+def load_pinyin_corpus(limit):
+    with open(PINYIN_CORPUS, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    return [entry for entry in entries if len(entry['chinese']) > 0][:limit]
+
+def load_jyutping_corpus(limit):
+    with open(JYUTPING_CORPUS, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    return [entry['Chinese'] for entry in entries if len(entry['Chinese']) > 0][:limit]
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def latency_statistics(durations):
+    durations = sorted(durations)
+    total = sum(durations)
+    return {
+        'count': len(durations),
+        'mean_us': total / len(durations) * 1e6,
+        'p50_us': percentile(durations, 0.5) * 1e6,
+        'p99_us': percentile(durations, 0.99) * 1e6,
+        'max_us': durations[-1] * 1e6,
+        'per_second': len(durations) / total if total > 0 else None
+    }
+
+def measure_latency(convert, texts):
+    # one warm-up pass, so that we measure the steady state (jieba, caches)
+    for text in texts:
+        convert(text)
+    durations = []
+    for text in texts:
+        start_time = time.perf_counter()
+        convert(text)
+        durations.append(time.perf_counter() - start_time)
+    return latency_statistics(durations)
+
+# phases
+# ======
+
+COLD_LOAD_SCRIPT = '''
+import sys, json, time
+start_time = time.perf_counter()
+import pinyin_jyutping
+import_time = time.perf_counter() - start_time
+instance = pinyin_jyutping.PinyinJyutping(**json.loads(sys.argv[1]))
+instance.warmup_jieba()
+total = time.perf_counter() - start_time
+print(json.dumps({'import': import_time, 'total': total, 'phases': instance.timings}))
+'''
+
+def benchmark_cold_load(options):
+    # in a fresh process, nothing is loaded or cached yet
+    result = {}
+    for name, constructor_options in [('pickle', {}), ('compact_data', {'compact_data': True})]:
+        output = subprocess.run([sys.executable, '-c', COLD_LOAD_SCRIPT, json.dumps(constructor_options)],
+            cwd=ROOT_DIRECTORY, capture_output=True, text=True, check=True).stdout
+        result[name] = json.loads(output.strip().split('\n')[-1])
+    return result
+
+def benchmark_pinyin_latency(instance, options):
+    texts = [entry['chinese'] for entry in load_pinyin_corpus(options.limit)]
+    return measure_latency(instance.pinyin, texts)
+
+def benchmark_jyutping_latency(instance, options):
+    texts = load_jyutping_corpus(options.limit)
+    return measure_latency(instance.jyutping, texts)
+
+def benchmark_pinyin_all_solutions(instance, options):
+    texts = [entry['chinese'] for entry in load_pinyin_corpus(options.limit)]
+    return measure_latency(instance.pinyin_all_solutions, texts)
+
+def benchmark_parse_pinyin(instance, options):
+    texts = [entry['expected_pinyin'] for entry in load_pinyin_corpus(options.limit)]
+    errors = 0
+    syllable_count = 0
+    start_time = time.perf_counter()
+    for text in texts:
+        try:
+            syllable_count += len(pinyin_jyutping.parser.parse_pinyin(text))
+        except pinyin_jyutping.errors.PinyinParsingError:
+            errors += 1
+    duration = time.perf_counter() - start_time
+    return {
+        'count': len(texts),
+        'errors': errors,
+        'per_second': len(texts) / duration,
+        'syllables_per_second': syllable_count / duration
+    }
+
+def benchmark_process_word(instance, options):
+    entries = []
+    for entry in load_pinyin_corpus(options.limit):
+        try:
+            syllables = pinyin_jyutping.parser.parse_pinyin(entry['expected_pinyin'])
+        except pinyin_jyutping.errors.PinyinParsingError:
+            continue
+        chinese = pinyin_jyutping.parser.clean_chinese(entry['chinese'])
+        if len(syllables) == len(chinese):
+            entries.append((chinese, syllables))
+    # process_word segments each entry with jieba, whose prefix dictionary must not be built inside the timing
+    instance.warmup_jieba()
+    data = pinyin_jyutping.data.Data()
+    start_time = time.perf_counter()
+    for chinese, syllables in entries:
+        pinyin_jyutping.parser.process_word(chinese, syllables, data.pinyin_map)
+    duration = time.perf_counter() - start_time
+    return {
+        'count': len(entries),
+        'per_second': len(entries) / duration,
+        'words': len(data.pinyin_map)
+    }
+
+# conversion is instrumented with debug logging, some of which pretty-prints whole solution arrays. the
+# payloads are only built when debug logging is enabled. this compares the per-call cost of a conversion with
+# debug logging disabled (the normal case), and enabled but discarded.
+
+INSTRUMENTED_MODULES = [pinyin_jyutping.conversion, pinyin_jyutping.logic, pinyin_jyutping.parser]
+
+def set_debug_logging(enabled):
+    for module in INSTRUMENTED_MODULES:
+        module_logger = module.logger
+        if enabled:
+            # records get created, but go nowhere
+            module_logger.setLevel(logging.DEBUG)
+            module_logger.propagate = False
+            module_logger.addHandler(logging.NullHandler())
+        else:
+            module_logger.setLevel(logging.NOTSET)
+            module_logger.propagate = True
+            module_logger.handlers = []
+
+def benchmark_debug_logging(instance, options):
+    texts = [entry['chinese'] for entry in load_pinyin_corpus(options.limit)][:100]
+    set_debug_logging(True)
+    try:
+        debug_enabled = measure_latency(instance.pinyin, texts)
+    finally:
+        set_debug_logging(False)
+    debug_disabled = measure_latency(instance.pinyin, texts)
+    return {
+        'debug_enabled_mean_us': debug_enabled['mean_us'],
+        'debug_disabled_mean_us': debug_disabled['mean_us'],
+        'saving_us': debug_enabled['mean_us'] - debug_disabled['mean_us']
+    }
+
+PHASE_FUNCTIONS = {
+    'pinyin_latency': benchmark_pinyin_latency,
+    'jyutping_latency': benchmark_jyutping_latency,
+    'pinyin_all_solutions': benchmark_pinyin_all_solutions,
+    'parse_pinyin': benchmark_parse_pinyin,
+    'process_word': benchmark_process_word,
+    'debug_logging': benchmark_debug_logging,
+}
+
+# running and comparing
+# =====================
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIRECTORY, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run_benchmarks(phases, options):
+    results = {}
+    if 'cold_load' in phases:
+        results['cold_load'] = benchmark_cold_load(options)
+    instance = None
+    for phase in phases:
+        if phase == 'cold_load':
+            continue
+        if instance == None:
+            instance = pinyin_jyutping.PinyinJyutping()
+        logger.info(f'running {phase}')
+        results[phase] = PHASE_FUNCTIONS[phase](instance, options)
+    return {
+        'metadata': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'limit': options.limit
+        },
+        'results': results
+    }
+
+def flatten(results, prefix=''):
+    # {'a': {'b': 1}} -> {'a.b': 1}, numbers only
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+def compare(previous, current):
+    previous_values = flatten(previous['results'])
+    current_values = flatten(current['results'])
+    lines = []
+    for key, value in current_values.items():
+        previous_value = previous_values.get(key, None)
+        if previous_value == None or previous_value == 0:
+            continue
+        lines.append(f'{key}: {previous_value:.6g} -> {value:.6g} ({value / previous_value:.2f}x)')
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='pinyin_jyutping benchmark suite, writes json results')
+    parser.add_argument('--phases', nargs='+', choices=PHASES, default=PHASES)
+    parser.add_argument('--limit', type=int, default=None, help='number of corpus entries to use')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    parser.add_argument('--compare', help='results of a previous run, print the ratio of each measurement')
+    options = parser.parse_args()
+    results = run_benchmarks(options.phases, options)
+    output = json.dumps(results, indent=4, ensure_ascii=False)
+    if options.output != None:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    if options.compare != None:
+        with open(options.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        print(compare(previous, results), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
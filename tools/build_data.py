@@ -1,6 +1,9 @@
 import os
 import sys
 import pickle
+import hashlib
+import argparse
+import multiprocessing
 import logging
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
@@ -8,30 +11,160 @@ logging.basicConfig(level=logging.WARN)
 
 logger = logging.getLogger(__file__)
 
+import jieba
+
 import pinyin_jyutping.data
 import pinyin_jyutping.parser
+import pinyin_jyutping.conversion
 import pinyin_jyutping.constants
+import pinyin_jyutping.compact
+import pinyin_jyutping.tokenizer
+
+# incremental build
+# =================
+#
+# parsing a source file (regular expressions, romanization parsing, and above all jieba segmentation of every
+# entry) is what takes time. for each source, the resulting list of word additions is cached, keyed on the
+# hash of the source file and of the jieba dictionary. on the next build, only the sources which changed get
+# parsed again, the others are replayed from the cache. additions are always applied in the same order, so
+# the output doesn't depend on what was cached.
+
+# bump when the parsing logic changes, invalidates all cached additions
+BUILD_CACHE_VERSION = 1
+BUILD_CACHE_DIRECTORY = 'build_cache'
+
+# name, file, lines generator, lines -> word additions
+SOURCES = [
+    ('cedict', 'source_data/cedict_1_0_ts_utf-8_mdbg.txt',
+        pinyin_jyutping.parser.parse_cedict_file_generator,
+        pinyin_jyutping.parser.cedict_word_additions_generator),
+    ('cccanto', 'source_data/cccanto-webdist-160115.txt',
+        pinyin_jyutping.parser.parse_cccanto_line_generator,
+        pinyin_jyutping.parser.cccanto_definition_lines_word_additions_generator),
+    ('cccedict_canto_readings', 'source_data/cccedict-canto-readings-150923.txt',
+        pinyin_jyutping.parser.parse_cccanto_line_generator,
+        pinyin_jyutping.parser.cccedit_canto_readings_lines_word_additions_generator),
+]
+
+# parallel parsing
+# ================
+#
+# the lines of a source are cut into contiguous shards, which worker processes parse and segment. the
+# additions of each shard come back in shard order (imap), and are concatenated, so the result is exactly
+# the sequential one: the output doesn't depend on the number of workers or the shard size.
+
+SHARD_SIZE = 2000
+
+def shard_word_additions(arguments):
+    lines_additions_generator, lines = arguments
+    return list(lines_additions_generator(lines))
+
+def parse_source(filepath, lines_generator, lines_additions_generator, processes, shard_size=SHARD_SIZE):
+    if processes == 1:
+        return list(lines_additions_generator(lines_generator(filepath)))
+    # build jieba's prefix dictionary once, forked workers inherit it
+    jieba.initialize()
+    additions = []
+    with multiprocessing.Pool(processes) as pool:
+        shards = ((lines_additions_generator, shard) for shard in pinyin_jyutping.conversion.iterate_chunks(lines_generator(filepath), shard_size))
+        for shard_additions in pool.imap(shard_word_additions, shards):
+            additions.extend(shard_additions)
+    return additions
+
+def hash_file(file_object):
+    sha256 = hashlib.sha256()
+    for block in iter(lambda: file_object.read(1024 * 1024), b''):
+        sha256.update(block)
+    return sha256.hexdigest()
+
+def jieba_dictionary_hash():
+    # segmentation of the entries depends on the dictionary jieba uses
+    dictionary_file = jieba.dt.get_dict_file()
+    try:
+        return hash_file(dictionary_file)
+    finally:
+        dictionary_file.close()
+
+def source_cache_key(filepath, jieba_hash):
+    with open(filepath, 'rb') as f:
+        source_hash = hash_file(f)
+    return hashlib.sha256(f'{BUILD_CACHE_VERSION} {source_hash} {jieba_hash}'.encode('utf-8')).hexdigest()
+
+def load_cached_additions(cache_filepath):
+    if not os.path.isfile(cache_filepath):
+        return None
+    try:
+        with open(cache_filepath, 'rb') as f:
+            return pickle.load(f)
+    except Exception as e:
+        logger.warning(f'could not load {cache_filepath}, ignoring: {e}')
+        return None
+
+def source_additions(source, cache_directory, jieba_hash, processes):
+    """word additions for this source, parsed again only if the source or the jieba dictionary changed"""
+    source_name, filepath, lines_generator, lines_additions_generator = source
+    if cache_directory == None:
+        return parse_source(filepath, lines_generator, lines_additions_generator, processes)
+    cache_key = source_cache_key(filepath, jieba_hash)
+    cache_filepath = os.path.join(cache_directory, f'{source_name}.pkl')
+    cached = load_cached_additions(cache_filepath)
+    if cached != None and cached['key'] == cache_key:
+        logger.info(f'{source_name}: unchanged, using cached additions')
+        return cached['additions']
+    logger.info(f'{source_name}: parsing {filepath}')
+    additions = parse_source(filepath, lines_generator, lines_additions_generator, processes)
+    os.makedirs(cache_directory, exist_ok=True)
+    temporary_filepath = cache_filepath + '.tmp'
+    with open(temporary_filepath, 'wb') as f:
+        pickle.dump({'key': cache_key, 'additions': additions}, f)
+    os.replace(temporary_filepath, cache_filepath)
+    return additions
 
-data = pinyin_jyutping.data.Data()
+def build_data(sources, cache_directory, processes=1):
+    data = pinyin_jyutping.data.Data()
+    jieba_hash = None
+    if cache_directory != None:
+        jieba_hash = jieba_dictionary_hash()
+    for source in sources:
+        additions = source_additions(source, cache_directory, jieba_hash, processes)
+        pinyin_jyutping.parser.apply_word_additions(additions, data)
+    return data
 
-# ingest cedict data
-# ==================
+def write_output(data, output_directory):
+    # one pickle per map, which can be loaded independently
+    for map_name, filename in [
+        ('pinyin_map', pinyin_jyutping.constants.PINYIN_MAP_PICKLE_DATA_FILENAME),
+        ('jyutping_map', pinyin_jyutping.constants.JYUTPING_MAP_PICKLE_DATA_FILENAME)]:
+        map_file_path = os.path.join(output_directory, filename)
+        map_file = open(map_file_path, 'wb')
+        pickle.dump(getattr(data, map_name), map_file)
+        map_file.close()
+        logger.info(f'wrote {map_file_path}')
 
-filename = 'source_data/cedict_1_0_ts_utf-8_mdbg.txt'
-pinyin_jyutping.parser.parse_cedict(filename, data)
+    compact_file_path = os.path.join(output_directory, pinyin_jyutping.constants.COMPACT_DATA_FILENAME)
+    pinyin_jyutping.compact.write_compact_data(data, compact_file_path)
 
-# ingest jyutping data
-# ====================
+    logger.info(f'wrote {compact_file_path}')
 
-pinyin_jyutping.parser.parse_jyutping_cccanto_definition_process_words('source_data/cccanto-webdist-160115.txt', data)
-pinyin_jyutping.parser.parse_jyutping_ccedit_canto_readings_process_words('source_data/cccedict-canto-readings-150923.txt', data)
+    # prebuilt jieba prefix dictionary
+    jieba_dictionary_path = os.path.join(output_directory, pinyin_jyutping.constants.JIEBA_DICTIONARY_FILENAME)
+    jieba_cache_path = os.path.join(output_directory, pinyin_jyutping.constants.JIEBA_CACHE_FILENAME)
+    pinyin_jyutping.tokenizer.build_jieba_cache(jieba_dictionary_path, jieba_cache_path)
 
-# write output
-# ============
+    logger.info(f'wrote {jieba_cache_path}')
 
-pickle_file_path = f'pinyin_jyutping/{pinyin_jyutping.constants.PICKLE_DATA_FILENAME}'
-data_file = open(pickle_file_path, 'wb')
-pickle.dump(data, data_file)
-data_file.close()
+def main():
+    parser = argparse.ArgumentParser(description='build the pinyin_jyutping data files from the source dictionaries')
+    parser.add_argument('--cache-directory', default=BUILD_CACHE_DIRECTORY, help='where the parsed sources are cached')
+    parser.add_argument('--no-cache', action='store_true', help='parse all the sources from scratch')
+    parser.add_argument('--output-directory', default='pinyin_jyutping')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='number of processes parsing the sources')
+    args = parser.parse_args()
+    cache_directory = args.cache_directory
+    if args.no_cache:
+        cache_directory = None
+    data = build_data(SOURCES, cache_directory, args.processes)
+    write_output(data, args.output_directory)
 
-logger.info(f'wrote {pickle_file_path}')
\ No newline at end of file
+if __name__ == '__main__':
+    main()